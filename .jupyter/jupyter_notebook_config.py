@@ -1 +1,9 @@
-c.NotebookApp.contents_manager_class = 'jupytext.TextFileContentsManager'  # noqa
+import os
+import sys
+
+# Make the jupytext_tools package, at the root of this repository, importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The classic Notebook server (notebook < 7). Jupyter Server is configured in jupyter_server_config.py,
+# which also sets the warm kernel pool: the kernel manager of the classic server is a different class
+c.NotebookApp.contents_manager_class = 'jupytext_tools.contents.CachingTextFileContentsManager'  # noqa
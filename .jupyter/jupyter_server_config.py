@@ -0,0 +1,13 @@
+import os
+import sys
+
+# Make the jupytext_tools package, at the root of this repository, importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Jupyter Server (Binder's single-user server, JupyterLab, Notebook 7, nbclassic) reads this file,
+# and the ServerApp options only: NotebookApp options in jupyter_notebook_config.py are ignored there
+c.ServerApp.contents_manager_class = 'jupytext_tools.contents.CachingTextFileContentsManager'  # noqa
+
+# Hand over kernels in which pandas, plotly and ipywidgets are already imported. WarmKernelManager is
+# a Jupyter Server kernel manager, so the pool is available with Jupyter Server only
+c.ServerApp.kernel_manager_class = 'jupytext_tools.kernels.WarmKernelManager'  # noqa
@@ -0,0 +1 @@
+"""Tools for repositories of paired Jupyter notebooks, built on top of Jupytext"""
@@ -0,0 +1,372 @@
+"""An IPython extension that caches the outputs and the variables of the notebook cells.
+
+Load it in a notebook with
+
+    %load_ext jupytext_tools.cell_cache
+
+Every cell is then identified by a key: the hash of its source, and of the variables that it reads
+(as found by `jupytext_tools.parallel.cell_names`). A variable defined by a cell is identified by
+the key of that cell, and a module, or a function or class imported from a module, by the content
+of the module file. When a cell with the same key was run before, its outputs are displayed again,
+and the variables that it defined are restored from the cache, rather than computed. After a
+`jupytext --to ipynb --update`, "Run all" only runs the cells that changed, or that depend on a
+changed cell or module: e.g. a change in `world_bank.py` re-runs the cells that use `download_once`.
+
+Cells are not cached when they have magic or shell commands, fail, display widgets, or define
+variables that cannot be pickled (like modules, or functions defined in the notebook): these cells
+always run.
+
+The cache of a working directory is stored under the user cache directory ($XDG_CACHE_HOME, or
+~/.cache), in 'jupytext_tools/cell_cache/<hash of the directory>', and not next to the notebook, where it
+could be committed or shared. Unpickling a file can run arbitrary code, so every file is signed with an
+HMAC, with a key that only the user can read, and files with a wrong signature are ignored. As in `jupytext_tools.parallel`, objects modified by a method call are not detected as
+modified, and the files that a cell reads are not part of its key: use `%cell_cache clear` when they
+change. `%cell_cache` shows the hits and misses, `%cell_cache off` and `%cell_cache on` deactivate
+and reactivate the cache.
+"""
+
+import os
+import sys
+import uuid
+import types
+import hmac
+import pickle
+import shutil
+import hashlib
+from jupytext_tools.parallel import BARRIER, cell_names
+
+WIDGET_MIME_TYPE = 'application/vnd.jupyter.widget-view+json'
+
+# The cache of the IPython session where the extension is loaded
+cache = None
+
+
+def file_digest(path, _digests={}):
+    """The SHA-256 of a file, computed again only when its modification time or size change"""
+    stat = os.stat(path)
+    key = path, stat.st_mtime, stat.st_size
+    if key not in _digests:
+        with open(path, 'rb') as fp:
+            _digests[key] = hashlib.sha256(fp.read()).hexdigest()
+    return _digests[key]
+
+
+def module_digest(module):
+    """Identifies a module by its name and the content of its file"""
+    path = getattr(module, '__file__', None)
+    if path and os.path.isfile(path):
+        return '{}:{}'.format(module.__name__, file_digest(path))
+    return '{}:{}'.format(module.__name__, getattr(module, '__version__', ''))
+
+
+def value_hash(value):
+    """Identifies a value that was not defined by a cell, or None when it cannot be hashed"""
+    if isinstance(value, types.ModuleType):
+        return module_digest(value)
+    if isinstance(value, (types.FunctionType, type)):
+        # Functions and classes are pickled by reference: they are identified by the file of their module
+        module = sys.modules.get(value.__module__)
+        if module is None or value.__module__ == '__main__':
+            return None
+        return '{}.{}'.format(module_digest(module), value.__qualname__)
+    try:
+        return hashlib.sha256(pickle.dumps(value, protocol=4)).hexdigest()
+    except Exception:
+        return None
+
+
+def user_cache_dir():
+    """The directory where jupytext_tools caches data for the current user"""
+    root = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(root, 'jupytext_tools')
+
+
+def default_path(cwd=None):
+    """The cache of the cells run in the working directory 'cwd' (by default, the current one)"""
+    cwd = os.path.abspath(cwd or os.getcwd())
+    return os.path.join(user_cache_dir(), 'cell_cache', hashlib.sha256(cwd.encode('utf-8')).hexdigest()[:16])
+
+
+def secret_key(path=None):
+    """The key that signs the cached files: 32 random bytes, in a file that only the user can read"""
+    path = path or os.path.join(user_cache_dir(), 'cell_cache.key')
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path), mode=0o700)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as fp:
+            return fp.read()
+    key = os.urandom(32)
+    with os.fdopen(fd, 'wb') as fp:
+        fp.write(key)
+    return key
+
+
+class CellCache(object):
+    """Outputs and variables of the cells, stored as signed pickle files named after the key of the cell"""
+
+    def __init__(self, shell, path=None, secret=None):
+        self.shell = shell
+        self.path = path or default_path()
+        self.secret = secret or secret_key()
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.provenance = {}
+        self._cell = None
+        self._running = False
+        self._outputs = None
+        self._streams = None
+        self._publish = None
+        self._displayhook = None
+
+    def _file(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + '.pkl')
+
+    def _sign(self, data):
+        return hmac.new(self.secret, data, hashlib.sha256).digest()
+
+    def _read(self, key):
+        """The pickled outputs and variables of a cell, or None when the file is missing, or was not
+        signed with our key"""
+        try:
+            with open(self._file(key), 'rb') as fp:
+                content = fp.read()
+        except OSError:
+            return None
+        signature, data = content[:32], content[32:]
+        if not hmac.compare_digest(signature, self._sign(data)):
+            return None
+        return data
+
+    def key(self, source, reads):
+        """The key of a cell, or None when one of the variables it reads cannot be identified"""
+        digest = hashlib.sha256(source.encode('utf-8'))
+        for name in sorted(reads):
+            if name not in self.shell.user_ns:
+                continue
+            value = self.shell.user_ns[name]
+            identity = self.provenance.get(name)
+            if identity is None or _imported(value):
+                identity = value_hash(value)
+            if identity is None:
+                return None
+            digest.update('\n{}={}'.format(name, identity).encode('utf-8'))
+        return digest.hexdigest()
+
+    def transform(self, lines):
+        """Find the key of the cell, and replace the cells found in the cache with a call to `restore`.
+        IPython transforms a cell just before the 'pre_run_cell' event, and then runs it"""
+        if self._running:
+            # A magic like %time transforms code while the cell runs
+            return lines
+        self._cell = None
+        source = ''.join(lines)
+        if not self.enabled or not source.strip():
+            return lines
+        try:
+            reads, defined = cell_names(source)
+        except SyntaxError:
+            return lines
+
+        key = None if BARRIER in defined else self.key(source, reads)
+        data = self._read(key) if key is not None else None
+        self._cell = dict(key=key, defined=defined, hit=data is not None, data=data)
+        if self._cell['hit']:
+            return ['_cell_cache.restore({!r})\n'.format(key)]
+        return lines
+
+    def pre_run_cell(self, info=None):
+        self._running = True
+        if self._cell is not None and self._cell['key'] is not None and not self._cell['hit']:
+            self._record()
+
+    def restore(self, key):
+        """Restore the variables, and display again the outputs, of the cell with that key"""
+        data = self._cell['data'] if self._cell and self._cell['key'] == key else self._read(key)
+        if data is None:
+            raise KeyError('Cell {} is not in the cache, or its signature is not valid'.format(key))
+        cached = pickle.loads(data)
+        self.shell.user_ns.update(cached['variables'])
+        self.hits += 1
+
+        from IPython.display import publish_display_data
+        result = None
+        for output in cached['outputs']:
+            if output['output_type'] == 'stream':
+                getattr(sys, output['name']).write(output['text'])
+            elif output['output_type'] == 'execute_result':
+                result = _Result(output['data'], output['metadata'])
+            else:
+                publish_display_data(output['data'], output['metadata'])
+        return result
+
+    def _record(self):
+        """Record the outputs of the current cell, while they are displayed"""
+        self._outputs = outputs = []
+        display_pub = self.shell.display_pub
+        displayhook = self.shell.displayhook
+        self._publish = display_pub.publish
+        self._displayhook = displayhook.start_displayhook, displayhook.write_format_data, displayhook.finish_displayhook
+        paused = []
+
+        def publish(data, metadata=None, *args, **kwargs):
+            if not kwargs.get('transient') and not kwargs.get('update'):
+                outputs.append(dict(output_type='display_data', data=data, metadata=metadata or {}))
+            return self._publish(data, metadata, *args, **kwargs)
+
+        # A terminal displays the result of the cell on stdout, where it should not be recorded twice
+        def start_displayhook():
+            paused.append(True)
+            return self._displayhook[0]()
+
+        def write_format_data(format_dict, md_dict=None):
+            outputs.append(dict(output_type='execute_result', data=format_dict, metadata=md_dict or {}))
+            return self._displayhook[1](format_dict, md_dict)
+
+        def finish_displayhook():
+            del paused[:]
+            return self._displayhook[2]()
+
+        display_pub.publish = publish
+        displayhook.start_displayhook = start_displayhook
+        displayhook.write_format_data = write_format_data
+        displayhook.finish_displayhook = finish_displayhook
+        self._streams = sys.stdout, sys.stderr
+        sys.stdout = _Tee(sys.stdout, 'stdout', outputs, paused)
+        sys.stderr = _Tee(sys.stderr, 'stderr', outputs, paused)
+
+    def _stop_recording(self):
+        if self._outputs is None:
+            return None
+        self.shell.display_pub.publish = self._publish
+        displayhook = self.shell.displayhook
+        displayhook.start_displayhook, displayhook.write_format_data, displayhook.finish_displayhook = self._displayhook
+        sys.stdout, sys.stderr = self._streams
+        outputs, self._outputs = self._outputs, None
+        return outputs
+
+    def post_run_cell(self, result=None):
+        self._running = False
+        outputs = self._stop_recording()
+        cell, self._cell = self._cell, None
+        if cell is None:
+            return
+
+        success = result is None or result.success
+        for name in cell['defined']:
+            # The variables defined by a cell without a key, or by a failed cell, get a random key
+            self.provenance[name] = cell['key'] if success and cell['key'] else uuid.uuid4().hex
+        if cell['hit']:
+            return
+        if cell['key'] is None or not success or not self._save(cell, outputs):
+            self.uncached += 1
+        else:
+            self.misses += 1
+
+    def _save(self, cell, outputs):
+        """Save the outputs and variables of a cell. Returns False when they cannot be saved"""
+        if any(WIDGET_MIME_TYPE in output.get('data', {}) for output in outputs):
+            return False
+        variables = {name: self.shell.user_ns[name] for name in cell['defined'] if name in self.shell.user_ns}
+        try:
+            data = pickle.dumps(dict(outputs=_merge_streams(outputs), variables=variables), protocol=4)
+        except Exception:
+            return False
+        # Objects defined in the notebook are pickled by reference, and cannot be restored in a new kernel
+        if b'__main__' in data:
+            return False
+
+        path = self._file(cell['key'])
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), mode=0o700)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as fp:
+            fp.write(self._sign(data))
+            fp.write(data)
+        os.replace(tmp, path)
+        return True
+
+    def clear(self):
+        """Remove every cached cell"""
+        if os.path.isdir(self.path):
+            shutil.rmtree(self.path)
+
+    def report(self):
+        return 'Cell cache {} ({}): {} hit(s), {} miss(es), {} uncached cell(s)'.format(
+            'on' if self.enabled else 'off', self.path, self.hits, self.misses, self.uncached)
+
+
+def _imported(value):
+    """Is that value a module, or a function or class imported from a module?"""
+    if isinstance(value, types.ModuleType):
+        return True
+    return isinstance(value, (types.FunctionType, type)) and value.__module__ != '__main__'
+
+
+class _Tee(object):
+    """A stream that records what is written to it, unless 'paused' is not empty"""
+
+    def __init__(self, stream, name, outputs, paused):
+        self._stream = stream
+        self._name = name
+        self._outputs = outputs
+        self._paused = paused
+
+    def write(self, text):
+        if not self._paused:
+            self._outputs.append(dict(output_type='stream', name=self._name, text=text))
+        return self._stream.write(text)
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+
+class _Result(object):
+    """The cached result of a cell, displayed again as the result of the cell"""
+
+    def __init__(self, data, metadata):
+        self.data = data
+        self.metadata = metadata
+
+    def _repr_mimebundle_(self, include=None, exclude=None):
+        return self.data, self.metadata
+
+
+def _merge_streams(outputs):
+    """Merge the consecutive writes to the same stream"""
+    merged = []
+    for output in outputs:
+        if output['output_type'] == 'stream' and merged and merged[-1]['output_type'] == 'stream' \
+                and merged[-1]['name'] == output['name']:
+            merged[-1] = dict(merged[-1], text=merged[-1]['text'] + output['text'])
+        else:
+            merged.append(output)
+    return merged
+
+
+def load_ipython_extension(ipython):
+    global cache
+    if cache is not None:
+        return
+    cache = CellCache(ipython)
+    ipython.push({'_cell_cache': cache}, interactive=False)
+    ipython.events.register('pre_run_cell', cache.pre_run_cell)
+    ipython.events.register('post_run_cell', cache.post_run_cell)
+    ipython.input_transformers_post.append(cache.transform)
+
+    def cell_cache(line=''):
+        """Show the hits and misses of the cell cache, or: %cell_cache on|off|clear"""
+        action = line.strip()
+        if action in ('on', 'off'):
+            cache.enabled = action == 'on'
+        elif action == 'clear':
+            cache.clear()
+        elif action:
+            print('Usage: %cell_cache [on|off|clear]')
+            return
+        print(cache.report())
+
+    ipython.register_magic_function(cell_cache, 'line', 'cell_cache')
@@ -0,0 +1,363 @@
+"""A Jupytext contents manager with a cache of the parsed notebooks.
+
+With `jupytext.TextFileContentsManager`, every time a paired notebook is opened, both the text file
+and the ipynb file are read and parsed. `CachingTextFileContentsManager` keeps the most recently used
+notebook models in memory, and serves them again as long as the size and modification time of the
+notebook and of its paired files do not change. It also skips saving a notebook when its content is
+identical to what was last read or written.
+
+With 'async_save = True', notebooks are serialized and written on a worker thread, and `save` returns
+an awaitable, so that a large notebook does not block the server while it is written. Successive
+saves of a notebook that wait in the queue are coalesced into the most recent one. The save
+latencies are available with `save_stats()`.
+
+With 'use_atomic_writing' (the default), the files of a notebook and of its paired notebooks are
+written to temporary files that are then renamed, so that no file is ever partially written. The
+previous version of each file is kept (as a hard link, when possible) until the whole pair is
+written: when one of the files cannot be written, the files already renamed are restored.
+
+With 'outputs_store' set to a directory, the outputs are moved to that content-addressed store (see
+`jupytext_tools.outputs`) when notebooks are saved, and restored when they are opened, so that the
+ipynb files only contain the inputs and a hash for each output.
+
+Activate it in 'jupyter_server_config.py' (or, for the classic Notebook server, with NotebookApp in
+'jupyter_notebook_config.py') with
+
+    c.ServerApp.contents_manager_class = 'jupytext_tools.contents.CachingTextFileContentsManager'
+    c.CachingTextFileContentsManager.async_save = True
+    c.CachingTextFileContentsManager.outputs_store = '.outputs'
+"""
+
+import os
+import copy
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from nbformat.sign import NotebookNotary
+from traitlets import Bool, Integer, Unicode
+from jupytext import TextFileContentsManager
+from jupytext.paired_paths import paired_paths
+from jupytext.formats import long_form_multiple_formats
+from .outputs import OutputStore, copy_cells, strip_outputs, restore_outputs
+
+
+def content_digest(content):
+    """A hash of the metadata and cell sources of a notebook model. The outputs are not hashed: they
+    change when their cell is run, and so does its execution count, which is hashed with their number"""
+    digest = hashlib.sha1(json.dumps(content.get('metadata', {}), sort_keys=True).encode('utf-8'))
+    for cell in content.get('cells', []):
+        digest.update(json.dumps([cell.get('cell_type'), cell.get('source'), cell.get('metadata', {}),
+                                  cell.get('execution_count'), len(cell.get('outputs', []))],
+                                 sort_keys=True).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CachingTextFileContentsManager(TextFileContentsManager):
+    """A TextFileContentsManager with a bounded, in-memory cache of the notebook models"""
+
+    cache_size = Integer(64, config=True, help='Maximum number of notebook models kept in memory')
+    async_save = Bool(False, config=True, help='Save notebooks on a worker thread, without blocking the server')
+    outputs_store = Unicode('', config=True,
+                            help='Directory, relative to root_dir, where the notebook outputs are stored. '
+                                 'Default: outputs are kept in the ipynb files')
+    outputs_cache_bytes = Integer(2 ** 25, config=True,
+                                  help='Maximum size (as JSON) of the outputs of the store that are kept in memory')
+
+    def __init__(self, *args, **kwargs):
+        super(CachingTextFileContentsManager, self).__init__(*args, **kwargs)
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._executor = None
+        self._store = None
+        self._thread = threading.local()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.skipped_saves = 0
+        self.coalesced_saves = 0
+        self.save_latencies = deque(maxlen=1000)
+
+    def _paired_files(self, path, content):
+        """The OS paths of the notebook at 'path' and of its paired files"""
+        os_path = self._get_os_path(path)
+        formats = content.get('metadata', {}).get('jupytext', {}).get('formats') if content else None
+        if not formats:
+            return [os_path]
+
+        ext = os.path.splitext(os_path)[1]
+        for fmt in long_form_multiple_formats(formats):
+            if fmt['extension'] == ext:
+                try:
+                    return sorted(set([os_path] + [p for p, _ in paired_paths(os_path, fmt, formats)]))
+                except Exception:
+                    break
+        return [os_path]
+
+    @staticmethod
+    def _stamp(files):
+        """Size and modification time of the given files"""
+        stamp = []
+        for name in files:
+            try:
+                stat = os.stat(name)
+                stamp.append((name, stat.st_size, stat.st_mtime_ns))
+            except OSError:
+                stamp.append((name, None, None))
+        return tuple(stamp)
+
+    def _remember(self, path, entry):
+        with self._lock:
+            self._cache[path] = entry
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _forget(self, path):
+        with self._lock:
+            self._cache.pop(path, None)
+
+    def _cached(self, path):
+        """The cache entry for 'path', if the files on disk did not change since then"""
+        with self._lock:
+            entry = self._cache.get(path)
+            if entry is None:
+                return None
+            if self._stamp(entry['files']) != entry['stamp']:
+                del self._cache[path]
+                return None
+            self._cache.move_to_end(path)
+            return entry
+
+    def get(self, path, content=True, type=None, format=None, **kwargs):
+        """Get a file or directory model, from the cache for notebooks that did not change on disk"""
+        path = path.strip('/')
+        if not content or type not in (None, 'notebook') or kwargs.get('require_hash'):
+            return super(CachingTextFileContentsManager, self).get(path, content, type, format, **kwargs)
+
+        entry = self._cached(path)
+        if entry is not None and entry.get('model') is not None:
+            self.cache_hits += 1
+            return copy.deepcopy(entry['model'])
+
+        store = self._outputs_store()
+        self._thread.store = store
+        try:
+            model = super(CachingTextFileContentsManager, self).get(path, content, type, format, **kwargs)
+        finally:
+            self._thread.store = None
+        if model['type'] == 'notebook':
+            if store is not None:
+                restore_outputs(model['content'], store)
+            self.cache_misses += 1
+            files = self._paired_files(path, model['content'])
+            self._remember(path, dict(files=files, stamp=self._stamp(files), model=copy.deepcopy(model)))
+        return model
+
+    def save(self, model, path=''):
+        """Save a model. A notebook is not written again when its content did not change."""
+        path = path.strip('/')
+        if self.async_save and model.get('type') == 'notebook':
+            future = self._save_in_background(model, path)
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return future.result()
+            return asyncio.wrap_future(future)
+
+        return self._save(model, path)
+
+    def _outputs_store(self):
+        """The outputs store, created once, so that the outputs it keeps in memory are reused"""
+        if not self.outputs_store:
+            return None
+        path = os.path.join(self.root_dir, self.outputs_store)
+        with self._lock:
+            if self._store is None or self._store.path != path:
+                self._store = OutputStore(path, self.outputs_cache_bytes)
+            return self._store
+
+    def _save_in_background(self, model, path):
+        """Queue the save on the worker thread, or update the save of that notebook that is already queued"""
+        with self._lock:
+            pending = self._pending.get(path)
+            if pending is not None and not pending['started']:
+                pending['model'] = model
+                self.coalesced_saves += 1
+                return pending['future']
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(1)
+            pending = dict(model=model, started=False, queued=time.time())
+            pending['future'] = self._executor.submit(self._run_save, path, pending)
+            self._pending[path] = pending
+            return pending['future']
+
+    def _run_save(self, path, pending):
+        with self._lock:
+            pending['started'] = True
+            if self._pending.get(path) is pending:
+                del self._pending[path]
+
+        start = time.time()
+        self._thread.worker = True
+        try:
+            return self._save(pending['model'], path)
+        finally:
+            self._thread.worker = False
+            end = time.time()
+            self.save_latencies.append(dict(path=path, wait=start - pending['queued'], write=end - start))
+            self.log.debug('Saved %s in %.3fs (%.3fs in queue)', path, end - start, start - pending['queued'])
+
+    def mark_trusted_cells(self, nb, path=''):
+        """Mark the cells as trusted if the notebook, with its outputs, has a valid signature"""
+        store = getattr(self._thread, 'store', None)
+        if store is None:
+            return super(CachingTextFileContentsManager, self).mark_trusted_cells(nb, path)
+
+        restored = restore_outputs(copy_cells(nb), store)
+        super(CachingTextFileContentsManager, self).mark_trusted_cells(restored, path)
+        for cell, marked in zip(nb.cells, restored.cells):
+            if 'trusted' in marked.metadata:
+                cell.metadata['trusted'] = marked.metadata['trusted']
+
+    def check_and_sign(self, nb, path=''):
+        """Sign the notebook, with its outputs, if it is trusted"""
+        store = getattr(self._thread, 'store', None)
+        if store is not None:
+            nb = restore_outputs(copy_cells(nb), store)
+
+        # The notary uses a SQLite database, which cannot be shared between threads:
+        # notebooks saved in the background are signed by a notary of the worker thread
+        if getattr(self._thread, 'worker', False):
+            if getattr(self._thread, 'notary', None) is None:
+                self._thread.notary = NotebookNotary(parent=self)
+            notary = self._thread.notary
+        else:
+            notary = self.notary
+
+        if notary.check_cells(nb):
+            notary.sign(nb)
+        else:
+            self.log.warning('Notebook %s is not trusted', path)
+
+    def save_stats(self):
+        """Number of saves, and mean and maximum latencies of the recent saves, in seconds"""
+        latencies = list(self.save_latencies)
+        stats = dict(saves=len(latencies), coalesced=self.coalesced_saves, skipped=self.skipped_saves)
+        for name in ['wait', 'write']:
+            values = [latency[name] for latency in latencies] or [0.]
+            stats['mean_' + name] = sum(values) / len(values)
+            stats['max_' + name] = max(values)
+        return stats
+
+    def _save(self, model, path):
+        if model.get('type') == 'notebook' and model.get('content') is not None:
+            digest = content_digest(model['content'])
+            entry = self._cached(path)
+            if entry is not None:
+                if 'digest' not in entry:
+                    entry['digest'] = content_digest(entry['model']['content'])
+                if entry['digest'] == digest:
+                    self.skipped_saves += 1
+                    return self.get(path, content=False)
+
+            files = self._paired_files(path, model['content'])
+            store = self._outputs_store()
+            if store is not None:
+                model = dict(model, content=strip_outputs(copy_cells(model['content']), store))
+
+            self._thread.store = store
+            try:
+                with self._written_together():
+                    saved = super(CachingTextFileContentsManager, self).save(model, path)
+            finally:
+                self._thread.store = None
+            self._remember(path, dict(files=files, stamp=self._stamp(files), digest=digest))
+            return saved
+
+        self._forget(path)
+        return super(CachingTextFileContentsManager, self).save(model, path)
+
+    @contextmanager
+    def atomic_writing(self, os_path, text=True, encoding='utf-8', **kwargs):
+        """Write a file to a temporary file, renamed when it is complete, within `_written_together`.
+        A symlink is followed, and its target replaced, with the mode and (when permitted) the owner of
+        the original file"""
+        renamed = getattr(self._thread, 'renamed', None)
+        target = os.path.realpath(os_path)
+        directory = os.path.dirname(target)
+        if renamed is None or not self.use_atomic_writing or not os.access(directory, os.W_OK):
+            with super(CachingTextFileContentsManager, self).atomic_writing(
+                    os_path, text=text, encoding=encoding, **kwargs) as fp:
+                yield fp
+            return
+
+        name = os.path.basename(target)
+        tmp = os.path.join(directory, '.~{}.new'.format(name))
+        with self.perm_to_403(os_path):
+            if text:
+                kwargs.setdefault('newline', '\n')
+                fp = open(tmp, 'w', encoding=encoding, **kwargs)
+            else:
+                fp = open(tmp, 'wb', **kwargs)
+            try:
+                with fp:
+                    yield fp
+                    fp.flush()
+                    os.fsync(fp.fileno())
+            except BaseException:
+                os.remove(tmp)
+                raise
+
+            backup = None
+            if os.path.isfile(target):
+                shutil.copymode(target, tmp)
+                stat = os.stat(target)
+                try:
+                    os.chown(tmp, stat.st_uid, stat.st_gid)
+                except (AttributeError, OSError):
+                    pass
+                backup = os.path.join(directory, '.~{}.old'.format(name))
+                if os.path.exists(backup):
+                    os.remove(backup)
+                try:
+                    os.link(target, backup)
+                except OSError:
+                    shutil.copy2(target, backup)
+            os.replace(tmp, target)
+            renamed.append((target, backup))
+
+    @contextmanager
+    def _written_together(self):
+        """Restore the files renamed by `atomic_writing` if the save fails, and remove their backups"""
+        self._thread.renamed = renamed = []
+        try:
+            yield
+        except BaseException:
+            for os_path, backup in reversed(renamed):
+                if backup is None:
+                    os.remove(os_path)
+                else:
+                    os.replace(backup, os_path)
+            raise
+        else:
+            for _, backup in renamed:
+                if backup is not None:
+                    os.remove(backup)
+        finally:
+            self._thread.renamed = None
+
+    def delete_file(self, path):
+        self._forget(path.strip('/'))
+        return super(CachingTextFileContentsManager, self).delete_file(path)
+
+    def rename_file(self, old_path, new_path):
+        self._forget(old_path.strip('/'))
+        self._forget(new_path.strip('/'))
+        return super(CachingTextFileContentsManager, self).rename_file(old_path, new_path)
@@ -0,0 +1,158 @@
+"""A kernel manager that keeps a pool of pre-warmed kernels.
+
+Starting a Python kernel, and importing pandas, plotly and ipywidgets in it, takes a few seconds
+before the first cell of a notebook like Greenhouse_gas_emissions has even run. `WarmKernelManager`
+starts 'pool_size' kernels in advance, imports the 'warm_modules' in them and loads the
+`jupytext_tools.startup` extension (which times the imports of every cell). The pool is filled when
+the server starts. When a notebook asks for a kernel, a warm kernel is moved to the notebook's
+directory and handed over, and a new kernel is warmed in the background. Kernels in the pool are not
+listed, and are not culled.
+
+It is a Jupyter Server kernel manager: activate it in 'jupyter_server_config.py' with
+
+    c.ServerApp.kernel_manager_class = 'jupytext_tools.kernels.WarmKernelManager'
+    c.WarmKernelManager.pool_size = 2
+"""
+
+import os
+import uuid
+import asyncio
+from tornado.ioloop import IOLoop
+from traitlets import Integer, List, Unicode
+from jupyter_server.services.kernels.kernelmanager import AsyncMappingKernelManager
+
+# The directory that contains the jupytext_tools package
+TOOLS_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WARM_CODE = """
+import importlib as _importlib
+import sys as _sys
+for _name in {modules!r}:
+    try:
+        _importlib.import_module(_name)
+    except ImportError:
+        pass
+if {extensions!r}:
+    _sys.path.append({tools_path!r})
+    for _name in {extensions!r}:
+        get_ipython().extension_manager.load_extension(_name)
+del _importlib, _sys, _name
+"""
+
+HANDOVER_CODE = """
+import os as _os
+_os.chdir({cwd!r})
+_os.environ.update({env!r})
+del _os
+"""
+
+
+class WarmKernelManager(AsyncMappingKernelManager):
+    """An AsyncMappingKernelManager that hands over pre-warmed kernels"""
+
+    pool_size = Integer(2, config=True, help='Number of warm kernels kept in advance')
+    pool_kernel_name = Unicode('', config=True,
+                               help='Name of the kernels in the pool. Default: the default kernel name')
+    warm_modules = List(['numpy', 'pandas', 'tables', 'scipy.sparse', 'plotly.graph_objs', 'plotly.offline',
+                         'ipywidgets', 'wbdata'], config=True,
+                        help='Modules imported in the warm kernels (the modules that are not installed are skipped)')
+    warm_extensions = List(['jupytext_tools.startup'], config=True,
+                           help='IPython extensions loaded in the warm kernels')
+
+    def __init__(self, **kwargs):
+        super(WarmKernelManager, self).__init__(**kwargs)
+        self._pool = []
+        self._warming = set()
+        self._tasks = set()
+        self.warm_kernels_used = 0
+        # The server creates its event loop before the kernel manager, and runs it after
+        IOLoop.current().add_callback(self._fill_pool)
+
+    @property
+    def _pool_kernel_name(self):
+        return self.pool_kernel_name or self.default_kernel_name
+
+    def _fill_pool(self):
+        """Start warming new kernels, when the pool is not full"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        for _ in range(self.pool_size - len(self._pool) - len(self._warming)):
+            # The kernel counts as warming right away, so that the next call does not start it again
+            kernel_id = str(uuid.uuid4())
+            self._warming.add(kernel_id)
+            task = asyncio.ensure_future(self._warm_kernel(kernel_id))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _execute(self, kernel_id, code):
+        """Run code silently in a kernel, and wait until it is done"""
+        client = self.get_kernel(kernel_id).client()
+        client.start_channels()
+        try:
+            await client.wait_for_ready(timeout=self.kernel_info_timeout)
+            reply = await client.execute_interactive(code, silent=True, store_history=False,
+                                                     output_hook=lambda msg: None)
+        finally:
+            client.stop_channels()
+        if reply['content']['status'] != 'ok':
+            raise RuntimeError('{}: {}'.format(reply['content'].get('ename'), reply['content'].get('evalue')))
+
+    async def _warm_kernel(self, kernel_id):
+        try:
+            await super(WarmKernelManager, self)._async_start_kernel(kernel_id=kernel_id,
+                                                                     kernel_name=self._pool_kernel_name)
+            await self._execute(kernel_id, WARM_CODE.format(modules=list(self.warm_modules),
+                                                            extensions=list(self.warm_extensions),
+                                                            tools_path=TOOLS_PATH))
+        except Exception as err:
+            self.log.warning('Could not warm kernel %s: %s', kernel_id, err)
+            if kernel_id in self:
+                await self._async_shutdown_kernel(kernel_id, now=True)
+            return
+        finally:
+            self._warming.discard(kernel_id)
+
+        self._pool.append(kernel_id)
+        self.log.info('Kernel %s is warm (%d kernel(s) in the pool)', kernel_id, len(self._pool))
+
+    async def _async_start_kernel(self, *, kernel_id=None, path=None, **kwargs):
+        """Hand over a warm kernel when one is available, or else start a new kernel"""
+        kernel_name = kwargs.get('kernel_name') or self.default_kernel_name
+        while kernel_id is None and kernel_name == self._pool_kernel_name and self._pool:
+            warm_id = self._pool.pop(0)
+            if warm_id not in self:
+                continue
+            env = {name: value for name, value in (kwargs.get('env') or {}).items()
+                   if os.environ.get(name) != value}
+            cwd = self.cwd_for_path(path) if path is not None else self.root_dir
+            try:
+                await self._execute(warm_id, HANDOVER_CODE.format(cwd=cwd, env=env))
+            except Exception as err:
+                self.log.warning('Could not hand over warm kernel %s: %s', warm_id, err)
+                await self._async_shutdown_kernel(warm_id, now=True)
+                continue
+
+            self.warm_kernels_used += 1
+            self.log.info('Using warm kernel %s for %s', warm_id, path)
+            self._fill_pool()
+            return warm_id
+
+        kernel_id = await super(WarmKernelManager, self)._async_start_kernel(kernel_id=kernel_id, path=path, **kwargs)
+        self._fill_pool()
+        return kernel_id
+
+    start_kernel = _async_start_kernel
+
+    def _in_pool(self, kernel_id):
+        return kernel_id in self._warming or kernel_id in self._pool
+
+    def list_kernels(self):
+        """The running kernels, not counting those in the pool"""
+        return [model for model in super(WarmKernelManager, self).list_kernels() if not self._in_pool(model['id'])]
+
+    async def cull_kernel_if_idle(self, kernel_id):
+        if self._in_pool(kernel_id):
+            return
+        await super(WarmKernelManager, self).cull_kernel_if_idle(kernel_id)
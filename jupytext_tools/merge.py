@@ -0,0 +1,358 @@
+"""A three-way merge of text notebooks, cell by cell, that keeps the outputs of the paired ipynb file.
+
+Git merges text notebooks line by line: two branches that add cells at the same place, like a new
+section on one side and a new plot on the other, conflict. Here the base, our and their versions of
+the notebook are read with Jupytext, and merged as lists of cells:
+- the cells changed on one side only are taken from that side,
+- the cells inserted at the same place on both sides are all kept, ours first,
+- a cell changed on both sides is merged line by line, and is a conflict only when the same lines
+  changed.
+Conflicts are marked in the notebook as usual, with the conflicting cells of each side. When there
+is no conflict, the paired ipynb file is updated with `jupytext_tools.update`: the outputs of every
+cell that is left unchanged are kept, and only the new or modified cells have to be run. Note that
+git only expects the merge driver to write the merged text notebook: the ipynb file is rewritten in
+the working tree, as a side effect, and is neither staged nor part of the merge commit unless it is
+added (it is usually not under version control, as the outputs change at every run).
+
+Use it as a git merge driver for the notebooks:
+
+    git config merge.jupytext.name "Cell-level merge of text notebooks"
+    git config merge.jupytext.driver "python -m jupytext_tools.merge %O %A %B %P"
+    echo 'notebook/*.py merge=jupytext' >> .gitattributes
+
+or, after a merge or a rebase stopped on conflicts, to merge every conflicted notebook in a single
+process (the other files are left to git):
+
+    python -m jupytext_tools.merge --unmerged
+"""
+
+import os
+import sys
+import json
+import uuid
+import argparse
+import subprocess
+from difflib import SequenceMatcher
+import nbformat
+import jupytext
+from jupytext.formats import NOTEBOOK_EXTENSIONS
+from .update import update_notebook
+
+MARKER_SIZE = 7
+
+
+def _sync_regions(base, ours, theirs):
+    """The ranges that are identical in the three sequences: (base start, base end, our start, their start)"""
+    our_blocks = SequenceMatcher(None, base, ours, autojunk=False).get_matching_blocks()
+    their_blocks = SequenceMatcher(None, base, theirs, autojunk=False).get_matching_blocks()
+    regions = []
+    i = j = 0
+    while i < len(our_blocks) and j < len(their_blocks):
+        our_base, our_start, our_length = our_blocks[i]
+        their_base, their_start, their_length = their_blocks[j]
+        start = max(our_base, their_base)
+        end = min(our_base + our_length, their_base + their_length)
+        if start < end:
+            regions.append((start, end, our_start + start - our_base, their_start + start - their_base))
+        if our_base + our_length < their_base + their_length:
+            i += 1
+        else:
+            j += 1
+    regions.append((len(base), len(base), len(ours), len(theirs)))
+    return regions
+
+
+def merge3(base, ours, theirs):
+    """Three-way merge of sequences of hashable items. Returns a list of chunks: ('ours', start, end) or
+    ('theirs', start, end) for the merged ranges of our or their sequence, and ('conflict', base range,
+    our range, their range) for the ranges changed differently on both sides"""
+    chunks = []
+    base_pos = our_pos = their_pos = 0
+    for base_start, base_end, our_start, their_start in _sync_regions(base, ours, theirs):
+        changed_base = base[base_pos:base_start]
+        changed_ours = ours[our_pos:our_start]
+        changed_theirs = theirs[their_pos:their_start]
+        if changed_ours == changed_base:
+            chunks.append(('theirs', their_pos, their_start))
+        elif changed_theirs == changed_base or changed_ours == changed_theirs:
+            chunks.append(('ours', our_pos, our_start))
+        elif len(changed_base) == len(changed_ours) == len(changed_theirs):
+            # Items replaced one for one on both sides (e.g. different lines of a cell) are merged one by one
+            for k, (item, our_item, their_item) in enumerate(zip(changed_base, changed_ours, changed_theirs)):
+                if our_item == item:
+                    chunks.append(('theirs', their_pos + k, their_pos + k + 1))
+                elif their_item == item or our_item == their_item:
+                    chunks.append(('ours', our_pos + k, our_pos + k + 1))
+                else:
+                    chunks.append(('conflict', (base_pos + k, base_pos + k + 1), (our_pos + k, our_pos + k + 1),
+                                   (their_pos + k, their_pos + k + 1)))
+        else:
+            chunks.append(('conflict', (base_pos, base_start), (our_pos, our_start), (their_pos, their_start)))
+
+        chunks.append(('ours', our_start, our_start + base_end - base_start))
+        base_pos, our_pos, their_pos = base_end, our_start + base_end - base_start, their_start + base_end - base_start
+    return [chunk for chunk in chunks if chunk[0] == 'conflict' or chunk[1] < chunk[2]]
+
+
+def merge_lines(base, ours, theirs):
+    """Three-way merge of texts, line by line, or None if they conflict"""
+    lines = [text.splitlines(True) for text in (base, ours, theirs)]
+    merged = []
+    for chunk in merge3(*lines):
+        if chunk[0] == 'conflict':
+            return None
+        merged.extend((lines[1] if chunk[0] == 'ours' else lines[2])[chunk[1]:chunk[2]])
+    return ''.join(merged)
+
+
+def merge_metadata(base, ours, theirs):
+    """Our metadata, with the entries that changed on their side only"""
+    merged = dict(ours)
+    for key in set(base) | set(theirs):
+        if theirs.get(key) != base.get(key) and ours.get(key) == base.get(key):
+            if key in theirs:
+                merged[key] = theirs[key]
+            else:
+                merged.pop(key, None)
+    return merged
+
+
+def _cell_key(cell):
+    return cell.cell_type, cell.source, json.dumps(cell.metadata, sort_keys=True)
+
+
+def merge_cells(base, ours, theirs):
+    """Merge three lists of cells. Returns the merged list, in which every conflict is a tuple
+    (our cells, their cells), and the number of conflicts"""
+    merged = []
+    conflicts = 0
+    for chunk in merge3([_cell_key(cell) for cell in base], [_cell_key(cell) for cell in ours],
+                        [_cell_key(cell) for cell in theirs]):
+        if chunk[0] != 'conflict':
+            merged.extend((ours if chunk[0] == 'ours' else theirs)[chunk[1]:chunk[2]])
+            continue
+
+        base_cells, our_cells, their_cells = (cells[start:end] for cells, (start, end) in zip((base, ours, theirs),
+                                                                                           chunk[1:]))
+        if not base_cells:
+            # Cells inserted at the same place on both sides
+            keys = set(_cell_key(cell) for cell in our_cells)
+            merged.extend(our_cells + [cell for cell in their_cells if _cell_key(cell) not in keys])
+            continue
+
+        cell = _merge_cell(base_cells, our_cells, their_cells)
+        if cell is not None:
+            merged.append(cell)
+        else:
+            merged.append((our_cells, their_cells))
+            conflicts += 1
+    return merged, conflicts
+
+
+def _merge_cell(base_cells, our_cells, their_cells):
+    """A cell changed on both sides, merged line by line, or None if that is not possible"""
+    if not len(base_cells) == len(our_cells) == len(their_cells) == 1:
+        return None
+    base, ours, theirs = base_cells[0], our_cells[0], their_cells[0]
+    if not base.cell_type == ours.cell_type == theirs.cell_type:
+        return None
+
+    source = merge_lines(base.source, ours.source, theirs.source)
+    if source is None:
+        return None
+
+    cell = nbformat.from_dict(dict(ours))
+    cell.source = source
+    cell.metadata = merge_metadata(base.metadata, ours.metadata, theirs.metadata)
+    return cell
+
+
+def _header(text):
+    """The lines of a text notebook before its first cell: encoding, YAML header, and the blank line after it"""
+    lines = text.splitlines(True)
+    for i, line in enumerate(lines[:2]):
+        if line.rstrip() == '# ---':
+            for j in range(i + 1, len(lines)):
+                if lines[j].rstrip() == '# ---':
+                    end = j + 1
+                    if end < len(lines) and not lines[end].strip():
+                        end += 1
+                    return ''.join(lines[:end])
+    return ''
+
+
+def merge_notebooks(base_text, our_text, their_text, fmt):
+    """Merge three versions of a text notebook. Returns the merged text, and the number of conflicts"""
+    base, ours, theirs = (jupytext.reads(text, fmt=fmt) for text in (base_text, our_text, their_text))
+    cells, conflicts = merge_cells(base.cells, ours.cells, theirs.cells)
+    metadata = merge_metadata(base.metadata, ours.metadata, theirs.metadata)
+
+    if metadata == ours.metadata and not conflicts:
+        if [_cell_key(cell) for cell in cells] == [_cell_key(cell) for cell in ours.cells]:
+            return our_text, 0
+        if metadata == theirs.metadata and [_cell_key(cell) for cell in cells] == [_cell_key(cell)
+                                                                                   for cell in theirs.cells]:
+            return their_text, 0
+
+    # The conflicts are written in place of placeholder cells
+    token = uuid.uuid4().hex
+    placeholders = {}
+    notebook_cells = []
+    for cell in cells:
+        if isinstance(cell, tuple):
+            placeholder = 'CONFLICT {} {}'.format(token, len(placeholders))
+            placeholders['# ' + placeholder] = _conflict(cell, metadata, fmt)
+            cell = nbformat.v4.new_markdown_cell(placeholder)
+        notebook_cells.append(cell)
+
+    text = jupytext.writes(nbformat.v4.new_notebook(cells=notebook_cells, metadata=metadata), fmt=fmt)
+    text = _keep_formatting(our_text, jupytext.writes(ours, fmt=fmt), text)
+    if placeholders:
+        text = ''.join(placeholders.get(line.rstrip('\n'), line) for line in text.splitlines(True))
+    return text, conflicts
+
+
+def _keep_formatting(original, written, merged):
+    """The 'merged' notebook, written like our 'original' text rather than like the current version of
+    Jupytext does (header, cell markers...): the changes from 'written', our notebook as Jupytext
+    writes it, to 'merged', are applied to 'original'"""
+    text = merge_lines(written, original, merged)
+    return merged if text is None else text
+
+
+def _conflict(cells, metadata, fmt):
+    """The text of a conflict between our cells and their cells"""
+    options = dict(metadata.get('jupytext', {}), notebook_metadata_filter='-all')
+    options.pop('encoding', None)
+    ours, theirs = (jupytext.writes(nbformat.v4.new_notebook(cells=side, metadata=dict(jupytext=options)), fmt=fmt)
+                    for side in cells)
+    return '{} ours\n{}{}\n{}{} theirs\n'.format('<' * MARKER_SIZE, ours, '=' * MARKER_SIZE, theirs,
+                                                  '>' * MARKER_SIZE)
+
+
+def is_text_notebook(text):
+    """Does that text have a Jupytext header?"""
+    return 'jupytext:' in _header(text)
+
+
+def update_paired_ipynb(path, text):
+    """Update the inputs of the ipynb file paired with the text notebook at 'path', if there is one,
+    with the merged 'text'.
+
+    The ipynb file in the working tree is rewritten directly, also when this is called from the
+    merge driver: 'path' is then relative to the root of the repository, where git runs the driver,
+    and the ipynb file is not staged."""
+    notebook = jupytext.reads(text, fmt=os.path.splitext(path)[1][1:])
+    formats = notebook.metadata.get('jupytext', {}).get('formats', '')
+    ipynb = os.path.splitext(path)[0] + '.ipynb'
+    if 'ipynb' in formats.split(',') and os.path.isfile(ipynb):
+        update_notebook(notebook, ipynb)
+
+
+def merge_file(base_path, our_path, their_path, path=None):
+    """The git merge driver: merge into 'our_path' the changes from base to 'their_path'. 'path' is the
+    path of the notebook in the repository. Returns the number of conflicts"""
+    path = path or our_path
+    with open(our_path, encoding='utf-8') as fp:
+        our_text = fp.read()
+    if not is_text_notebook(our_text):
+        # Not a notebook: the usual line by line merge
+        return min(subprocess.call(['git', 'merge-file', '-L', 'ours', '-L', 'base', '-L', 'theirs',
+                                    our_path, base_path, their_path]), 1)
+
+    texts = []
+    for other in (base_path, their_path):
+        with open(other, encoding='utf-8') as fp:
+            texts.append(fp.read())
+    text, conflicts = merge_notebooks(texts[0], our_text, texts[1], os.path.splitext(path)[1][1:])
+
+    with open(our_path, 'w', encoding='utf-8') as fp:
+        fp.write(text)
+    if not conflicts:
+        update_paired_ipynb(path, text)
+    return conflicts
+
+
+def _git(*args, **kwargs):
+    return subprocess.run(['git'] + list(args), check=True, stdout=subprocess.PIPE, **kwargs).stdout
+
+
+def read_blobs(shas):
+    """The content of the given git objects, read with a single 'git cat-file' process"""
+    if not shas:
+        return {}
+    output = _git('cat-file', '--batch', input=''.join(sha + '\n' for sha in shas).encode())
+    blobs = {}
+    pos = 0
+    for sha in shas:
+        end = output.index(b'\n', pos)
+        size = int(output[pos:end].split()[2])
+        blobs[sha] = output[end + 1:end + 1 + size].decode('utf-8')
+        pos = end + 1 + size + 1
+    return blobs
+
+
+def is_text_notebook_path(path):
+    """Can the file at that path be a text notebook? Only those are read, as text, from git"""
+    ext = os.path.splitext(path)[1]
+    return ext in NOTEBOOK_EXTENSIONS and ext != '.ipynb'
+
+
+def merge_unmerged(paths=()):
+    """Merge every conflicted text notebook in the working tree (or in 'paths'), and stage those
+    merged without conflicts. Returns the paths merged, and those that still have conflicts"""
+    stages = {}
+    for entry in _git('ls-files', '-u', '-z', '--', *paths).decode('utf-8').split('\0'):
+        if entry:
+            info, path = entry.split('\t', 1)
+            if not is_text_notebook_path(path):
+                # Other files, like binary data caches, are left to git
+                continue
+            _, sha, stage = info.split()
+            stages.setdefault(path, {})[stage] = sha
+
+    # Files added or deleted on one side are left to git
+    stages = {path: shas for path, shas in stages.items() if len(shas) == 3}
+    blobs = read_blobs(sorted(set(sha for shas in stages.values() for sha in shas.values())))
+
+    merged, conflicted = [], []
+    for path, shas in sorted(stages.items()):
+        base_text, our_text, their_text = (blobs[shas[stage]] for stage in '123')
+        if not is_text_notebook(our_text):
+            continue
+        text, conflicts = merge_notebooks(base_text, our_text, their_text, os.path.splitext(path)[1][1:])
+        with open(path, 'w', encoding='utf-8') as fp:
+            fp.write(text)
+        if conflicts:
+            conflicted.append(path)
+            continue
+        merged.append(path)
+        update_paired_ipynb(path, text)
+
+    if merged:
+        _git('add', '--', *merged)
+    return merged, conflicted
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('files', nargs='*',
+                        help='As a merge driver: the base, our and their versions, and the path of the notebook. '
+                             'With --unmerged: optional paths to restrict the merge to')
+    parser.add_argument('--unmerged', action='store_true', help='Merge every conflicted notebook in the working tree')
+    args = parser.parse_args(args)
+
+    if args.unmerged:
+        merged, conflicted = merge_unmerged(args.files)
+        print('{} notebook(s) merged, {} with conflicts'.format(len(merged), len(conflicted)))
+        for path in conflicted:
+            print('Conflict: {}'.format(path), file=sys.stderr)
+        return 1 if conflicted else 0
+
+    if len(args.files) not in (3, 4):
+        parser.error('expected the base, our and their files, and optionally the path of the notebook')
+    return 1 if merge_file(*args.files) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
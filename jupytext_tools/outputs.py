@@ -0,0 +1,134 @@
+"""A content-addressed store for the outputs of Jupyter notebooks.
+
+Outputs like plotly figures, or the plotly.js bundle that `offline.init_notebook_mode()` embeds,
+make ipynb files megabytes large. `strip_outputs` moves every output to a side store, where it is
+saved once under the SHA-256 of its content, and leaves a small stub in the notebook. Identical
+outputs, in the same or in other notebooks, are stored just once. `restore_outputs` does the
+reverse. The stubs are valid 'display_data' outputs, so the stripped notebooks remain valid
+notebooks. Example:
+
+    python -m jupytext_tools.outputs strip Greenhouse_gas_emissions.ipynb --store .outputs
+"""
+
+import os
+import sys
+import json
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+import nbformat
+
+STUB_KEY = 'outputs_store'
+
+
+class OutputStore(object):
+    """Outputs, stored as JSON files named after the SHA-256 of their content.
+
+    The outputs that were recently stored or read are also kept in memory, by this object, up to
+    'max_bytes' of JSON, and `get` returns them without reading the files again. The least
+    recently used outputs are dropped first."""
+
+    def __init__(self, path, max_bytes=2 ** 25):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._outputs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _file(self, digest):
+        return os.path.join(self.path, digest[:2], digest[2:] + '.json')
+
+    def _remember(self, digest, output, size):
+        with self._lock:
+            if digest not in self._outputs:
+                self.nbytes += size
+            self._outputs[digest] = output, size
+            self._outputs.move_to_end(digest)
+            while self.nbytes > self.max_bytes:
+                _, (_, dropped) = self._outputs.popitem(last=False)
+                self.nbytes -= dropped
+
+    def put(self, output):
+        """Store an output (if it is not already there) and return its hash"""
+        text = json.dumps(output, sort_keys=True, separators=(',', ':'))
+        digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self._remember(digest, output, len(text))
+        path = self._file(digest)
+        if not os.path.isfile(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as fp:
+                fp.write(text)
+            os.replace(tmp, path)
+        return digest
+
+    def get(self, digest):
+        """The output with that hash, or None if it is not in the store"""
+        with self._lock:
+            if digest in self._outputs:
+                self._outputs.move_to_end(digest)
+                return self._outputs[digest][0]
+        path = self._file(digest)
+        if not os.path.isfile(path):
+            return None
+        with open(path) as fp:
+            text = fp.read()
+        output = nbformat.from_dict(json.loads(text))
+        self._remember(digest, output, len(text))
+        return output
+
+
+def stub(digest):
+    """The output that stands for an output in the store"""
+    return nbformat.v4.new_output('display_data', data={'text/plain': '[output {}]'.format(digest[:12])},
+                                  metadata={STUB_KEY: digest})
+
+
+def copy_cells(nb):
+    """A copy of the notebook that can be stripped or restored without changing the original one:
+    only the notebook and its cells are copied, not their sources or outputs"""
+    nb = nbformat.NotebookNode(nb)
+    nb.cells = [nbformat.NotebookNode(cell) for cell in nb.cells]
+    return nb
+
+
+def strip_outputs(nb, store):
+    """Move the outputs of the notebook to the store (the notebook is modified in place)"""
+    for cell in nb.cells:
+        if cell.cell_type == 'code':
+            cell.outputs = [output if STUB_KEY in output.get('metadata', {}) else stub(store.put(output))
+                            for output in cell.outputs]
+    return nb
+
+
+def restore_outputs(nb, store):
+    """Replace the stubs in the notebook with the outputs in the store (the notebook is modified in place).
+    Stubs for which the store has no output are left as they are."""
+    for cell in nb.cells:
+        if cell.cell_type == 'code':
+            outputs = []
+            for output in cell.outputs:
+                digest = output.get('metadata', {}).get(STUB_KEY)
+                outputs.append((store.get(digest) or output) if digest else output)
+            cell.outputs = outputs
+    return nb
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('action', choices=['strip', 'restore'])
+    parser.add_argument('notebooks', nargs='+', help='ipynb files')
+    parser.add_argument('--store', default='.outputs', help='Directory of the outputs store')
+    args = parser.parse_args(args)
+
+    store = OutputStore(args.store)
+    for path in args.notebooks:
+        nb = nbformat.read(path, as_version=4)
+        (strip_outputs if args.action == 'strip' else restore_outputs)(nb, store)
+        nbformat.write(nb, path)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,403 @@
+"""Execute a text notebook with several kernels, running the independent cells concurrently.
+
+The code cells of the notebook are parsed, and every cell depends on the cells that last defined
+the names that it reads (variables, functions, imported modules, and also objects that it modifies
+with an assignment like `pd.options.display.max_rows = 6`). The final cells, on which no other
+cell depends, are distributed over the kernels, each with the cells it depends on: a kernel runs
+its cells in the order of the notebook, and the cells needed by several kernels are run in each
+of them. The state of a kernel cannot be shared with the others, so a shared cell is run first in
+one kernel, and only once it is done in the other kernels: a cell that writes a file, like a cache
+that is filled on the first run, does not write it concurrently. The outputs are collected in the
+paired ipynb file, in the order of the notebook.
+
+Objects modified by a method call (e.g. `data.append(x)`) are not detected as modified. A cell
+that modifies, in that way, an object defined in another cell should also assign it. Cells with
+a `from module import *`, and cells with magic or shell commands, are run in every kernel in which
+a later cell runs. Cells tagged 'run-last', like a cell that reports on what the other cells did,
+run in a final step: at the end of one of the kernels, once all the other kernels are done. Example:
+
+    python -m jupytext_tools.parallel Greenhouse_gas_emissions.py --kernels 4
+"""
+
+import os
+import ast
+import sys
+import argparse
+import threading
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+import nbformat
+import jupytext
+from jupyter_client.manager import start_new_kernel
+
+# The cells that define this name are dependencies of every later cell
+BARRIER = '*'
+
+# The cells with this tag run after every other cell
+RUN_LAST = 'run-last'
+
+
+class _Names(ast.NodeVisitor):
+    """The names that a piece of code defines, and the names it reads before defining them"""
+
+    def __init__(self, local=()):
+        self.defined = set(local)
+        self.reads = set()
+        self.free = set()
+        self.globals = set()
+
+    def _read(self, name):
+        if name not in self.defined:
+            self.reads.add(name)
+
+    def _nested(self, local, nodes):
+        """Names read by a function, class or comprehension, which has its own scope"""
+        inner = _Names(local)
+        for node in nodes:
+            inner.visit(node)
+        self.free.update((inner.reads | inner.free) - inner.defined)
+        self.defined.update(inner.globals)
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self._read(node.id)
+        else:
+            self.defined.add(node.id)
+
+    def _target(self, node):
+        """The object modified by 'x.attr = ...' or 'x[key] = ...' is 'x'"""
+        while isinstance(node, (ast.Attribute, ast.Subscript)):
+            if isinstance(node, ast.Subscript):
+                self.visit(node.slice)
+            node = node.value
+        if isinstance(node, ast.Name):
+            self._read(node.id)
+            self.defined.add(node.id)
+        else:
+            self.visit(node)
+
+    def _targets(self, node):
+        if isinstance(node, (ast.Tuple, ast.List)):
+            for element in node.elts:
+                self._targets(element)
+        elif isinstance(node, ast.Starred):
+            self._targets(node.value)
+        elif isinstance(node, (ast.Attribute, ast.Subscript)):
+            self._target(node)
+        else:
+            self.visit(node)
+
+    def visit_Assign(self, node):
+        self.visit(node.value)
+        for target in node.targets:
+            self._targets(target)
+
+    def visit_AnnAssign(self, node):
+        if node.value is not None:
+            self.visit(node.value)
+        self._targets(node.target)
+
+    def visit_AugAssign(self, node):
+        self.visit(node.value)
+        if isinstance(node.target, ast.Name):
+            self._read(node.target.id)
+        self._targets(node.target)
+
+    def visit_For(self, node):
+        self.visit(node.iter)
+        self._targets(node.target)
+        for statement in node.body + node.orelse:
+            self.visit(statement)
+
+    visit_AsyncFor = visit_For
+
+    def visit_withitem(self, node):
+        self.visit(node.context_expr)
+        if node.optional_vars is not None:
+            self._targets(node.optional_vars)
+
+    def visit_Delete(self, node):
+        for target in node.targets:
+            self._targets(target)
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.defined.add(alias.asname or alias.name.split('.')[0])
+
+    def visit_ImportFrom(self, node):
+        for alias in node.names:
+            self.defined.add(BARRIER if alias.name == '*' else alias.asname or alias.name)
+
+    def visit_Global(self, node):
+        self.globals.update(node.names)
+
+    def visit_FunctionDef(self, node):
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self.visit(node.args)
+        self.defined.add(node.name)
+        arguments = node.args.posonlyargs + node.args.args + node.args.kwonlyargs
+        local = [argument.arg for argument in arguments + [node.args.vararg, node.args.kwarg] if argument]
+        self._nested(local, node.body)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_arguments(self, node):
+        for default in node.defaults + [default for default in node.kw_defaults if default is not None]:
+            self.visit(default)
+
+    def visit_Lambda(self, node):
+        self.visit(node.args)
+        arguments = node.args.posonlyargs + node.args.args + node.args.kwonlyargs
+        self._nested([argument.arg for argument in arguments + [node.args.vararg, node.args.kwarg] if argument],
+                     [node.body])
+
+    def visit_ClassDef(self, node):
+        for expr in node.decorator_list + node.bases + node.keywords:
+            self.visit(expr)
+        self.defined.add(node.name)
+        self._nested((), node.body)
+
+    def _comprehension(self, node, elements):
+        # The first iterable is evaluated in the enclosing scope
+        self.visit(node.generators[0].iter)
+        inner = _Names()
+        for i, generator in enumerate(node.generators):
+            if i:
+                inner.visit(generator.iter)
+            inner._targets(generator.target)
+            for condition in generator.ifs:
+                inner.visit(condition)
+        for element in elements:
+            inner.visit(element)
+        self.free.update((inner.reads | inner.free) - inner.defined)
+
+    def visit_ListComp(self, node):
+        self._comprehension(node, [node.elt])
+
+    visit_SetComp = visit_GeneratorExp = visit_ListComp
+
+    def visit_DictComp(self, node):
+        self._comprehension(node, [node.key, node.value])
+
+
+def transform_cell(source):
+    """The Python code of a cell: the magic and shell commands are turned into Python calls"""
+    try:
+        from IPython.core.inputtransformer2 import TransformerManager
+    except ImportError:
+        return '\n'.join(line for line in source.splitlines() if not line.lstrip().startswith(('%', '!')))
+    return TransformerManager().transform_cell(source)
+
+
+def cell_names(source):
+    """The names that a code cell reads (before defining them), and the names it defines or modifies"""
+    code = transform_cell(source)
+    names = _Names()
+    names.visit(ast.parse(code))
+    reads = names.reads | (names.free - names.defined)
+    if 'get_ipython' in reads:
+        names.defined.add(BARRIER)
+    return reads, names.defined
+
+
+def dependencies(sources):
+    """The indices of the cells on which every cell depends, directly"""
+    defined_by = {}
+    barriers = []
+    depends = []
+    for i, source in enumerate(sources):
+        reads, defined = cell_names(source)
+        depends.append(set(defined_by[name] for name in reads if name in defined_by) | set(barriers))
+        for name in defined:
+            defined_by[name] = i
+        if BARRIER in defined:
+            barriers.append(i)
+    return depends
+
+
+def ancestors(depends):
+    """The indices of the cells on which every cell depends, directly or not, including the cell itself"""
+    closure = []
+    for i, direct in enumerate(depends):
+        cells = {i}
+        for j in direct:
+            cells.update(closure[j])
+        closure.append(cells)
+    return closure
+
+
+def schedule(depends, kernels, run_last=()):
+    """Distribute the cells over (at most) 'kernels' kernels. Returns the sorted cells of every kernel.
+
+    The cells in 'run_last' are not distributed: they all go, with the cells they depend on, to the
+    kernel that already has most of these cells, and come after its other cells"""
+    closure = ancestors(depends)
+    needed = set(j for i, direct in enumerate(depends) if i not in run_last for j in direct)
+    jobs = sorted((closure[i] for i in range(len(depends)) if i not in needed and i not in run_last),
+                  key=len, reverse=True)
+
+    # Every job goes to the kernel that has the fewest cells once the job is added to it,
+    # and then to the kernel where it adds the fewest cells
+    groups = [set() for _ in range(max(1, min(kernels, len(jobs))))]
+    for job in jobs:
+        group = min(groups, key=lambda cells: (len(cells | job), len(job - cells)))
+        group.update(job)
+
+    final = None
+    if run_last:
+        last = set(j for i in run_last for j in closure[i]) - set(run_last)
+        final = max(groups, key=lambda cells: len(cells & last))
+        final.update(last)
+    return [sorted(group) + (sorted(run_last) if group is final else []) for group in groups
+            if group or group is final]
+
+
+class CellError(Exception):
+    """An exception raised in a cell"""
+
+
+def run_cells(sources, cwd, kernel_name='python3', timeout=None, before=None, after=None):
+    """Run the given cells in a new kernel, and return their outputs. Stops at the first error.
+    'before' and 'after' are called with the position of every cell, before and after it is run"""
+    manager, client = start_new_kernel(kernel_name=kernel_name, cwd=cwd)
+    results = []
+    try:
+        for position, source in enumerate(sources):
+            outputs = []
+
+            def collect(msg, outputs=outputs):
+                msg_type = msg['header']['msg_type']
+                if msg_type == 'clear_output':
+                    del outputs[:]
+                elif msg_type in ('stream', 'display_data', 'execute_result', 'error'):
+                    outputs.append(nbformat.v4.output_from_msg(msg))
+
+            if before:
+                before(position)
+            start = perf_counter()
+            try:
+                reply = client.execute_interactive(source, timeout=timeout, output_hook=collect)
+            finally:
+                if after:
+                    after(position)
+            results.append(dict(outputs=outputs, execution_count=reply['content'].get('execution_count'),
+                                seconds=perf_counter() - start))
+            if reply['content']['status'] != 'ok':
+                raise CellError('{}: {}'.format(reply['content'].get('ename'), reply['content'].get('evalue')),
+                                results)
+    finally:
+        client.stop_channels()
+        manager.shutdown_kernel(now=True)
+    return results
+
+
+def code_cells(notebook):
+    """The code cells of a notebook that are not empty, and the positions of those tagged 'run-last'"""
+    cells = [cell for cell in notebook.cells if cell.cell_type == 'code' and cell.source.strip()]
+    return cells, set(i for i, cell in enumerate(cells) if RUN_LAST in cell.metadata.get('tags', []))
+
+
+def execute(text_path, ipynb_path=None, kernels=4, kernel_name=None, timeout=None, fmt=None):
+    """Execute the text notebook with at most 'kernels' kernels, and write the paired ipynb file.
+    Returns the cells of every kernel, and the list of the errors"""
+    if ipynb_path is None:
+        ipynb_path = os.path.splitext(text_path)[0] + '.ipynb'
+    notebook = jupytext.read(text_path, fmt=fmt)
+    cells, run_last = code_cells(notebook)
+    groups = schedule(dependencies([cell.source for cell in cells]), kernels, run_last)
+
+    kernel_name = kernel_name or notebook.metadata.get('kernelspec', {}).get('name') or 'python3'
+    cwd = os.path.dirname(os.path.abspath(text_path))
+
+    # A cell shared by several kernels runs first in the first of them, and then in the others.
+    # A kernel only waits for kernels that come before it, so they cannot wait for each other
+    first = {}
+    for kernel, group in enumerate(groups):
+        for i in group:
+            first.setdefault(i, kernel)
+    done = {i: threading.Event() for i in first if sum(i in group for group in groups) > 1}
+    # The 'run-last' cells, at the end of a kernel, wait until all the other kernels are done
+    finished = [threading.Event() for _ in groups]
+
+    def run(kernel):
+        group = groups[kernel]
+
+        def before(position):
+            if group[position] in run_last:
+                for other, event in enumerate(finished):
+                    if other != kernel:
+                        event.wait()
+            if group[position] in done and first[group[position]] != kernel:
+                done[group[position]].wait()
+
+        def after(position):
+            if group[position] in done and first[group[position]] == kernel:
+                done[group[position]].set()
+
+        try:
+            return run_cells([cells[i].source for i in group], cwd, kernel_name, timeout, before, after), None
+        except CellError as err:
+            return err.args[1], err
+        finally:
+            # The other kernels run the shared cells that this kernel did not reach
+            for i in group:
+                if i in done and first[i] == kernel:
+                    done[i].set()
+            finished[kernel].set()
+
+    with ThreadPoolExecutor(len(groups)) as executor:
+        results = list(executor.map(run, range(len(groups))))
+
+    # The outputs of a cell come from the first kernel that ran it
+    outputs = {}
+    errors = []
+    for group, (cell_results, error) in zip(groups, results):
+        for i, result in zip(group, cell_results):
+            outputs.setdefault(i, result)
+        if error is not None:
+            errors.append(error)
+
+    count = 0
+    for i, cell in enumerate(cells):
+        cell.outputs = outputs[i]['outputs'] if i in outputs else []
+        cell.execution_count = None
+        if i in outputs:
+            count += 1
+            cell.execution_count = count
+        for output in cell.outputs:
+            if output.output_type == 'execute_result':
+                output.execution_count = cell.execution_count
+
+    jupytext.write(notebook, ipynb_path)
+    return groups, errors
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('notebook', help='Text notebook, e.g. a .py file')
+    parser.add_argument('--to', dest='ipynb', help='The ipynb file. Default: same name as the text notebook')
+    parser.add_argument('--kernels', type=int, default=4, help='Maximum number of kernels')
+    parser.add_argument('--kernel', help='Name of the kernel. Default: the kernel of the notebook')
+    parser.add_argument('--timeout', type=float, help='Timeout of every cell, in seconds')
+    parser.add_argument('--format', dest='fmt', help="Format of the text notebook, e.g. 'py:light'")
+    parser.add_argument('--dry-run', action='store_true', help='Show the cells of every kernel, and stop')
+    args = parser.parse_args(args)
+
+    if args.dry_run:
+        cells, run_last = code_cells(jupytext.read(args.notebook, fmt=args.fmt))
+        for kernel, group in enumerate(schedule(dependencies([cell.source for cell in cells]), args.kernels,
+                                                run_last), 1):
+            print('Kernel {}: cells {}'.format(kernel, ', '.join(str(i + 1) for i in group)))
+        return
+
+    start = perf_counter()
+    groups, errors = execute(args.notebook, args.ipynb, args.kernels, args.kernel, args.timeout, args.fmt)
+    print('{} kernel(s), {:.1f}s'.format(len(groups), perf_counter() - start))
+    for error in errors:
+        print('Error: {}'.format(error.args[0]), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""An IPython extension that measures, and optionally defers, the imports of every cell.
+
+Load it in a notebook with
+
+    %load_ext jupytext_tools.startup
+
+Then `%import_times` shows, for every cell, the time spent importing new modules, and which
+modules these were. `%defer_imports pandas plotly.offline` makes the later imports of these modules
+lazy: `import pandas as pd` returns immediately, and pandas is actually loaded when one of its
+attributes is first used. Only modules written in Python can be deferred (not extension modules).
+"""
+
+import sys
+import builtins
+import importlib.abc
+import importlib.util
+import importlib.machinery
+from time import perf_counter
+
+# The timer of the IPython session where the extension is loaded
+timer = None
+
+
+class ImportTimer(object):
+    """Records the time spent, in each cell, on import statements that load new modules"""
+
+    def __init__(self):
+        self.cells = []
+        self._import = None
+        self._depth = 0
+        self._imports = []
+
+    def _timed_import(self, name, *args, **kwargs):
+        # Imports made by the imported modules are included in the time of the outer import
+        if self._depth:
+            return self._import(name, *args, **kwargs)
+
+        new = name not in sys.modules
+        self._depth += 1
+        start = perf_counter()
+        try:
+            return self._import(name, *args, **kwargs)
+        finally:
+            self._depth -= 1
+            if new and name in sys.modules:
+                self._imports.append((name, perf_counter() - start))
+
+    def pre_run_cell(self, info=None):
+        self._imports = []
+        self._import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def post_run_cell(self, result=None):
+        if self._import is not None:
+            builtins.__import__ = self._import
+            self._import = None
+        if self._imports:
+            self.cells.append(dict(execution_count=getattr(result, 'execution_count', None),
+                                   seconds=sum(seconds for _, seconds in self._imports),
+                                   modules=list(self._imports)))
+
+    def report(self):
+        """The import times, one line per cell"""
+        lines = []
+        for cell in self.cells:
+            modules = ', '.join('{} ({:.3f}s)'.format(name, seconds) for name, seconds in cell['modules'])
+            lines.append('In [{}]: {:.3f}s  {}'.format(cell['execution_count'], cell['seconds'], modules))
+        total = sum(cell['seconds'] for cell in self.cells)
+        lines.append('Total: {:.3f}s in {} cell(s)'.format(total, len(self.cells)))
+        return '\n'.join(lines)
+
+
+class LazyFinder(importlib.abc.MetaPathFinder):
+    """Loads the given modules with `importlib.util.LazyLoader`: they are executed on first use"""
+
+    def __init__(self, names=()):
+        self.names = set(names)
+
+    def find_spec(self, name, path, target=None):
+        if name not in self.names:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+
+        # Extension modules create their module object themselves, and cannot be loaded lazily
+        if isinstance(spec.loader, importlib.machinery.SourceFileLoader):
+            spec.loader = importlib.util.LazyLoader(spec.loader)
+        return spec
+
+
+def defer_imports(names):
+    """Defer the imports of the given modules, when they are not imported already"""
+    finder = next((finder for finder in sys.meta_path if isinstance(finder, LazyFinder)), None)
+    if finder is None:
+        finder = LazyFinder()
+        sys.meta_path.insert(0, finder)
+    finder.names.update(name for name in names if name not in sys.modules)
+    return finder
+
+
+def load_ipython_extension(ipython):
+    global timer
+    if timer is not None:
+        return
+    timer = ImportTimer()
+    ipython.events.register('pre_run_cell', timer.pre_run_cell)
+    ipython.events.register('post_run_cell', timer.post_run_cell)
+
+    def import_times(line=''):
+        """Time spent importing new modules, per cell"""
+        print(timer.report())
+
+    def defer(line=''):
+        """Defer the imports of the given modules until they are used, e.g. %defer_imports pandas"""
+        finder = defer_imports(line.split())
+        print('Deferred imports: ' + (', '.join(sorted(finder.names)) or 'none'))
+
+    ipython.register_magic_function(import_times, 'line', 'import_times')
+    ipython.register_magic_function(defer, 'line', 'defer_imports')
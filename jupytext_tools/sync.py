@@ -0,0 +1,174 @@
+"""Synchronize every paired notebook in a directory tree, in a single command.
+
+This is `jupytext --sync` for a whole tree: Jupytext is imported just once per worker process,
+pairs that did not change since the last synchronization are skipped, and the other pairs are
+synchronized in parallel. Example:
+
+    python -m jupytext_tools.sync notebooks/ --jobs 8
+
+The size, modification time and SHA-1 of the paired files are recorded in '.jupytext_sync.json'
+at the root of the tree. A pair is skipped when its files have the recorded size and modification
+time, or, when only the modification times changed (e.g. after a `git checkout`), the recorded
+content hashes. A pair that fails to synchronize does not stop the others: its error is reported
+at the end, and it is synchronized again on the next run.
+"""
+
+import os
+import re
+import sys
+import json
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from jupytext.formats import NOTEBOOK_EXTENSIONS, long_form_multiple_formats
+from jupytext.paired_paths import paired_paths
+
+STATE_FILE = '.jupytext_sync.json'
+
+# The 'formats' entry in the YAML header of a text notebook, or in the metadata of an ipynb file
+_TEXT_FORMATS = re.compile(r'^\W*\s+formats:\s*(\S+)\s*$', re.MULTILINE)
+_IPYNB_FORMATS = re.compile(r'"formats":\s*"([^"]+)"')
+
+
+def notebook_formats(path):
+    """The paired formats of a notebook, or None if the notebook is not paired.
+
+    Only the beginning of text notebooks, where the YAML header is, and the end of ipynb files,
+    where the notebook metadata is, are read. When the formats are not in the last 8 KB of an ipynb
+    file (e.g. because the widget state in the metadata is larger than that), the whole file is parsed."""
+    ext = os.path.splitext(path)[1]
+    with open(path, 'rb') as fp:
+        if ext == '.ipynb':
+            fp.seek(0, os.SEEK_END)
+            size = fp.tell()
+            fp.seek(max(0, size - 8192))
+            match = _IPYNB_FORMATS.search(fp.read().decode('utf-8', 'replace'))
+            if not match and size > 8192:
+                fp.seek(0)
+                try:
+                    metadata = json.loads(fp.read().decode('utf-8')).get('metadata', {})
+                except ValueError:
+                    return None
+                return metadata.get('jupytext', {}).get('formats')
+        else:
+            match = _TEXT_FORMATS.search(fp.read(4096).decode('utf-8', 'replace'))
+    return match.group(1).strip('\'"') if match else None
+
+
+def find_pairs(root):
+    """The paired notebooks in a directory tree, as sorted tuples of paths"""
+    pairs = set()
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        for filename in filenames:
+            ext = os.path.splitext(filename)[1]
+            if ext not in NOTEBOOK_EXTENSIONS:
+                continue
+
+            path = os.path.join(dirpath, filename)
+            formats = notebook_formats(path)
+            if not formats:
+                continue
+
+            for fmt in long_form_multiple_formats(formats):
+                if fmt['extension'] == ext:
+                    try:
+                        pairs.add(tuple(sorted(p for p, _ in paired_paths(path, fmt, formats))))
+                    except Exception as err:
+                        sys.stderr.write('[jupytext_tools] Skipping {}: {}\n'.format(path, err))
+                    break
+
+    return sorted(pairs)
+
+
+def file_state(path, with_hash=False):
+    """Size and modification time of a file, and optionally its SHA-1"""
+    if not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    state = dict(size=stat.st_size, mtime=stat.st_mtime)
+    if with_hash:
+        with open(path, 'rb') as fp:
+            state['sha1'] = hashlib.sha1(fp.read()).hexdigest()
+    return state
+
+
+def in_sync(pair, recorded):
+    """Is the pair unchanged since it was last synchronized?"""
+    if not recorded:
+        return False
+
+    current = {path: file_state(path) for path in pair}
+    if any(current[path] is None or path not in recorded for path in pair):
+        return False
+    if all(current[path]['size'] == recorded[path]['size'] and
+           current[path]['mtime'] == recorded[path]['mtime'] for path in pair):
+        return True
+    return all(file_state(path, with_hash=True)['sha1'] == recorded[path]['sha1'] for path in pair)
+
+
+def sync_pair(pair):
+    """Synchronize one pair with `jupytext --sync`, and return the new state of its files"""
+    from jupytext.cli import jupytext
+    source = max((path for path in pair if os.path.isfile(path)), key=os.path.getmtime)
+    jupytext(['--sync', '--quiet', source])
+    return {path: file_state(path, with_hash=True) for path in pair}
+
+
+def sync_tree(root, jobs=None, dry_run=False):
+    """Synchronize the paired notebooks under 'root'. Returns the lists of synchronized and skipped pairs,
+    and the list of the pairs that failed, with their error"""
+    state_file = os.path.join(root, STATE_FILE)
+    state = {}
+    if os.path.isfile(state_file):
+        with open(state_file) as fp:
+            state = json.load(fp)
+
+    synced, skipped = [], []
+    for pair in find_pairs(root):
+        key = os.pathsep.join(os.path.relpath(path, root) for path in pair)
+        recorded = state.get(key)
+        if recorded:
+            recorded = {os.path.join(root, path): value for path, value in recorded.items()}
+        (skipped if in_sync(pair, recorded) else synced).append((key, pair))
+
+    failed = []
+    if synced and not dry_run:
+        with ProcessPoolExecutor(jobs) as pool:
+            futures = [(key, pair, pool.submit(sync_pair, pair)) for key, pair in synced]
+            for key, pair, future in futures:
+                try:
+                    files = future.result()
+                except (Exception, SystemExit) as err:
+                    # Jupytext exits on some errors: the pair failed, not the whole run
+                    failed.append((pair, err))
+                    state.pop(key, None)
+                    continue
+                state[key] = {os.path.relpath(path, root): value for path, value in files.items()}
+
+        with open(state_file, 'w') as fp:
+            json.dump(state, fp, indent=1, sort_keys=True)
+
+    failures = set(pair for pair, _ in failed)
+    return [pair for _, pair in synced if pair not in failures], [pair for _, pair in skipped], failed
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('root', nargs='?', default='.', help='Root of the directory tree')
+    parser.add_argument('--jobs', type=int, help='Number of worker processes. Default: number of CPUs')
+    parser.add_argument('--dry-run', action='store_true', help='List the pairs to synchronize, and stop')
+    args = parser.parse_args(args)
+
+    synced, skipped, failed = sync_tree(args.root, args.jobs, args.dry_run)
+    for pair in synced:
+        print(('Out of sync: ' if args.dry_run else 'Synchronized: ') + ', '.join(pair))
+    print('{} pair(s) {}, {} already in sync'.format(
+        len(synced), 'to synchronize' if args.dry_run else 'synchronized', len(skipped)))
+    for pair, err in failed:
+        sys.stderr.write('Failed: {}: {}\n'.format(', '.join(pair), err))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,214 @@
+"""Update the inputs of an ipynb file from its paired text notebook, without touching the outputs.
+
+`jupytext --to ipynb --update` loads the whole ipynb file, outputs included, as a notebook object,
+matches the cells of the text notebook against it, and serializes everything again. Here, the cells
+of the ipynb file are matched on a hash of their type and source, in linear time, and the cells that
+did not change are copied byte for byte from the original file: their outputs are neither decoded
+nor re-encoded. Only the new or modified cells are serialized. As with Jupytext, a modified cell
+keeps the outputs of the unmatched cell of the same type that follows the previous matched cell.
+The cell and notebook metadata are those of the text notebook, plus, as with Jupytext, the metadata
+that the text format does not store (e.g. 'collapsed', 'ExecuteTime' or the 'language_info').
+Example:
+
+    python -m jupytext_tools.update Greenhouse_gas_emissions.py
+"""
+
+import os
+import re
+import sys
+import json
+import uuid
+import hashlib
+import argparse
+from collections import defaultdict, deque
+import jupytext
+from jupytext.cell_metadata import _IGNORE_CELL_METADATA
+from jupytext.header import _DEFAULT_NOTEBOOK_METADATA
+from jupytext.metadata_filter import restore_filtered_metadata
+
+# In ipynb files written by nbformat (JSON with indent=1 and sorted keys), the cells are at depth 2,
+# and their fields at depth 3. JSON strings cannot contain newlines, so these markers are unambiguous.
+_CELLS_START = '\n "cells": [\n'
+_NO_CELLS = '\n "cells": [],\n'
+_CELLS_END = '\n ],\n'
+_CELL_SEPARATOR = '\n  },\n  {\n'
+_CELL_FIELD = re.compile(r'^   "(\w+)": ', re.MULTILINE)
+
+
+def dumps(obj):
+    """JSON, formatted like nbformat does"""
+    return json.dumps(obj, sort_keys=True, indent=1, ensure_ascii=False)
+
+
+def cell_key(cell_type, source):
+    """Identifies a cell by its type and the hash of its source"""
+    if isinstance(source, list):
+        source = ''.join(source)
+    return cell_type, hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+class RawCell(object):
+    """A cell of an ipynb file, as the original text. Only the type, metadata and source are decoded."""
+
+    def __init__(self, text):
+        self.text = text
+        fields = list(_CELL_FIELD.finditer(text))
+        values = {}
+        for field, following in zip(fields, fields[1:] + [None]):
+            end = following.start() if following else len(text) - len('\n  }')
+            values[field.group(1)] = text[field.end():end].rstrip().rstrip(',')
+        self.cell_type = json.loads(values['cell_type'])
+        self.metadata = json.loads(values.get('metadata', '{}'))
+        self.key = cell_key(self.cell_type, json.loads(values.get('source', '""')))
+
+    def updated(self, **fields):
+        """The text of the cell with updated fields, e.g. metadata (this cell is fully decoded)"""
+        cell = json.loads(self.text)
+        cell.update(fields)
+        return indent_cell(dumps(cell))
+
+
+def indent_cell(text):
+    """Indent a cell serialized at depth 0, to depth 2"""
+    return '\n'.join('  ' + line for line in text.splitlines())
+
+
+def split_ipynb(text):
+    """The notebook without its cells, and the raw text of every cell"""
+    start = text.find(_CELLS_START)
+    if start < 0:
+        start = text.find(_NO_CELLS)
+        if start < 0:
+            raise ValueError('Not a notebook in the nbformat layout')
+        return json.loads(text), []
+
+    end = text.find(_CELLS_END, start)
+    cells = text[start + len(_CELLS_START):end]
+    skeleton = json.loads(text[:start] + _NO_CELLS + text[end + len(_CELLS_END):])
+    bodies = cells[len('  {\n'):-len('\n  }')].split(_CELL_SEPARATOR)
+    return skeleton, [RawCell('  {\n' + body + '\n  }') for body in bodies]
+
+
+def new_cell(cell, with_id):
+    """The text of a cell from the text notebook, without outputs"""
+    source = cell.source.splitlines(True)
+    data = dict(cell_type=cell.cell_type, metadata=dict(cell.metadata), source=source)
+    if cell.cell_type == 'code':
+        data.update(execution_count=None, outputs=[])
+    if with_id:
+        data['id'] = uuid.uuid4().hex[:8]
+    return indent_cell(dumps(data))
+
+
+def notebook_metadata(notebook, old_metadata):
+    """The metadata of the text notebook, plus the old metadata that the text notebook does not store
+    (according to its 'notebook_metadata_filter'), without the 'text_representation'"""
+    metadata_filter = notebook.metadata.get('jupytext', {}).get('notebook_metadata_filter')
+    if metadata_filter == '-all':
+        metadata = dict(old_metadata)
+    else:
+        metadata = restore_filtered_metadata(notebook.metadata, old_metadata, metadata_filter,
+                                             _DEFAULT_NOTEBOOK_METADATA)
+    jupytext_metadata = dict(metadata.get('jupytext', {}))
+    jupytext_metadata.pop('text_representation', None)
+    if jupytext_metadata:
+        metadata['jupytext'] = jupytext_metadata
+    else:
+        metadata.pop('jupytext', None)
+    return metadata
+
+
+def cell_metadata(cell, old_metadata, metadata_filter):
+    """The metadata of a cell of the text notebook, plus the old metadata that the text notebook
+    does not store, like 'collapsed' or 'ExecuteTime'. Tags removed in the text notebook are removed"""
+    return restore_filtered_metadata(cell.metadata, old_metadata, metadata_filter, _IGNORE_CELL_METADATA)
+
+
+def update_ipynb(text_path, ipynb_path=None, fmt=None):
+    """Update the ipynb file paired with 'text_path'. Returns the number of cells kept, and updated"""
+    if ipynb_path is None:
+        ipynb_path = os.path.splitext(text_path)[0] + '.ipynb'
+    return update_notebook(jupytext.read(text_path, fmt=fmt), ipynb_path)
+
+
+def update_notebook(notebook, ipynb_path):
+    """Update the ipynb file with the cells and metadata of a notebook object read from a text file.
+    Returns the number of cells kept, and updated"""
+    if not os.path.isfile(ipynb_path):
+        jupytext.write(notebook, ipynb_path)
+        return 0, len(notebook.cells)
+
+    with open(ipynb_path, encoding='utf-8') as fp:
+        text = fp.read()
+    try:
+        skeleton, old_cells = split_ipynb(text)
+    except ValueError:
+        skeleton, old_cells = split_ipynb(dumps(json.loads(text)))
+
+    available = defaultdict(deque)
+    for position, cell in enumerate(old_cells):
+        available[cell.key].append(position)
+
+    # Cells with the same type and source, in order, and then, like `jupytext --update`, the cells
+    # of the same type that follow the previous match, for the cells that were modified
+    matches = [None] * len(notebook.cells)
+    for i, cell in enumerate(notebook.cells):
+        matching = available.get(cell_key(cell.cell_type, cell.source))
+        if matching:
+            matches[i] = matching.popleft()
+
+    unused = set(range(len(old_cells))).difference(matches)
+    previous = -1
+    for i, cell in enumerate(notebook.cells):
+        if matches[i] is None and previous + 1 in unused and cell.source.strip() and \
+                old_cells[previous + 1].cell_type == cell.cell_type:
+            matches[i] = previous + 1
+            unused.remove(previous + 1)
+        if matches[i] is not None:
+            previous = matches[i]
+
+    with_id = (skeleton['nbformat'], skeleton['nbformat_minor']) >= (4, 5)
+    metadata_filter = notebook.metadata.get('jupytext', {}).get('cell_metadata_filter')
+    cells = []
+    kept = 0
+    for cell, position in zip(notebook.cells, matches):
+        if position is None:
+            cells.append(new_cell(cell, with_id))
+            continue
+
+        old = old_cells[position]
+        metadata = cell_metadata(cell, old.metadata, metadata_filter)
+        if old.key != cell_key(cell.cell_type, cell.source):
+            cells.append(old.updated(source=cell.source.splitlines(True), metadata=metadata))
+            continue
+
+        kept += 1
+        if metadata == old.metadata:
+            cells.append(old.text)
+        else:
+            cells.append(old.updated(metadata=metadata))
+
+    skeleton['metadata'] = notebook_metadata(notebook, skeleton['metadata'])
+    text = dumps(skeleton)
+    if cells:
+        text = text.replace(_NO_CELLS, _CELLS_START + ',\n'.join(cells) + _CELLS_END, 1)
+
+    with open(ipynb_path, 'w', encoding='utf-8') as fp:
+        fp.write(text + '\n')
+
+    return kept, len(cells) - kept
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('notebook', help='Text notebook, e.g. a .py file')
+    parser.add_argument('--to', dest='ipynb', help='The ipynb file. Default: same name as the text notebook')
+    parser.add_argument('--format', dest='fmt', help="Format of the text notebook, e.g. 'py:light'")
+    args = parser.parse_args(args)
+
+    kept, updated = update_ipynb(args.notebook, args.ipynb, args.fmt)
+    print('{} cell(s) kept, {} cell(s) updated'.format(kept, updated))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
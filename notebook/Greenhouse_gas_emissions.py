@@ -40,26 +40,18 @@
 # The [World Bank](https://www.worldbank.org/) offers a wide set of economic and developement indicators. We download the values for a few of these indicators using `wbdata`, reshape the data using `pandas`, and explore the metrics using `ploty` and `ipywidgets`.
 
 # +
-import os
 import pandas as pd
-import wbdata as wb
+from world_bank import download_once, refresh, reload, MetricStore
+from metrics import DerivedColumns
+from profiling import Profiler
 
 # My preferences for printing DataFrames: few rows, and many columns.
 pd.options.display.max_rows = 6
 pd.options.display.max_columns = 20
 
-
-# Download just once the desired indicators, save to a file
-def download_once(indicators, path):
-    if os.path.isfile(path):
-        return pd.read_hdf(path, 'indicators')
-
-    data = wb.get_dataframe(indicators, convert_date=True).sort_index()
-    data.to_hdf(path, 'indicators')
-
-    return data
-
-
+# Set NOTEBOOK_PROFILE=1 in the environment of the kernel to record the calls to the data and
+# plotting functions in 'profile.jsonl' (see the Profiling section at the end)
+profiler = Profiler(log='profile.jsonl')
 # -
 
 # The names of the indicators below were found using the World Bank indicator [search page](https://data.worldbank.org/indicator). There are actually many more indicators there!
@@ -86,29 +78,40 @@ indicators = {
     'NY.GDP.MKTP.CD': 'GDP (current US$)',
     'NY.GDP.MKTP.KD': 'GDP (constant 2010 US$)'}
 
-world_bank_data = download_once(indicators, 'world_bank_indicators.hdf')
+# The indicators are loaded into a compact frame, that stores only the known values (as float32
+# when that is lossless: pass dtype=np.float32 to store every indicator as float32, at the cost of
+# precision). With a directory rather than a .hdf file, and lazy=True rather than compact=True,
+# world_bank_data becomes a lazy proxy that loads the indicators only when they are used.
+world_bank_data = profiler.instrument(download_once)(indicators, 'world_bank_indicators.hdf', compact=True)
+
+# We complement the indicators with a few derived metrics: emissions per capita, per sq. km and per
+# unit of GDP, annual growth rates, and averages over five years. See `metrics.DERIVED`.
+world_bank_data = DerivedColumns(world_bank_data)
 
 world_bank_data.loc['World']
 
 
 # +
-def world(metric):
-    """Value of desired metric, on the World, indexed by date"""
-    value = world_bank_data.loc['World'][metric].dropna()
-    return value
-
-
+# World regions, in order of increasing population
 zones = ['North America', 'Middle East & North Africa',
          'Latin America & Caribbean', 'Europe & Central Asia',
          'Sub-Saharan Africa', 'South Asia',
          'East Asia & Pacific'][::-1]
 
+# All the metrics, pivoted just once per region
+metric_store = MetricStore(world_bank_data, zones)
+
+
+@profiler.instrument(cache=lambda: (metric_store.hits, metric_store.misses))
+def world(metric):
+    """Value of desired metric, on the World, indexed by date"""
+    return metric_store.world(metric)
+
 
+@profiler.instrument(cache=lambda: (metric_store.hits, metric_store.misses))
 def regions(metric):
     """Value of desired metric, per world region (column), indexed by date"""
-    # World regions, in order of increasing population
-    value = world_bank_data.loc[zones][metric].dropna().swaplevel().unstack()[zones]
-    return value
+    return metric_store.regions(metric)
 
 
 # -
@@ -116,8 +119,17 @@ def regions(metric):
 # +
 import plotly.graph_objs as go
 import plotly.offline as offline
+from plotting import FigureBuilder
 
 offline.init_notebook_mode()
+
+# Maximum number of points per trace, above which series are downsampled (None: plot every point)
+max_points = None
+
+# Figures of a metric per world region, cached by metric. The profiler records the size of every
+# figure, and how often it was found in the cache
+figures = FigureBuilder(metric_store, max_points)
+figure = profiler.instrument(figures.figure, name='figure', cache=lambda: (figures.hits, figures.misses))
 # -
 
 # # Metric explorer
@@ -125,40 +137,75 @@ offline.init_notebook_mode()
 # +
 from ipywidgets import widgets
 from IPython.display import display
+from plotting import debounce, update_traces, xy, DATE_AXIS
+from metrics import is_additive
+from groupings import GroupStore, GROUPINGS
+
+# Custom groups of countries (G7, European Union...), aggregated from the country values
+group_store = GroupStore(world_bank_data, GROUPINGS)
 
 metric_selector = widgets.Dropdown(
     options=list(world_bank_data),
     value='CO2 emissions (kt)',
     description='Metric')
 
-metric_explorer = go.FigureWidget()
+grouping_selector = widgets.Dropdown(
+    options=['World regions'] + list(group_store.groupings),
+    value='World regions',
+    description='Groups')
+
+metric_explorer = go.FigureWidget(layout=dict(xaxis=DATE_AXIS))
 
 
+# When the selection changes quickly, only the last metric is plotted,
+# and the traces are updated in place, in a single message to the browser
+@debounce(0.1)
+@profiler.instrument
 def update_plot(change):
     m = metric_selector.value
+    grouping = grouping_selector.value
     if m in world_bank_data:
-        metric_explorer.data = []
-        metric_explorer.layout.title = m
+        if grouping in group_store.groupings:
+            value_region = group_store.groups(m, grouping)
+            disjoint = group_store.groupings[grouping].disjoint
+        else:
+            value_region = regions(m)
+            disjoint = True
+        stackgroup = m if disjoint and is_additive(m, world_bank_data) else None
 
         value_world = world(m)
+        traces = [dict(name=region, stackgroup=stackgroup, **xy(value_region[region], max_points))
+                  for region in value_region.columns]
+        traces.append(dict(name='World', line=dict(dash='dash'), **xy(value_world, max_points)))
 
-        value_region = regions(m)
-        for region in zones:
-            metric_explorer.add_scatter(x=value_region.index, y=value_region[region], name=region,
-                                        stackgroup=m if '%' not in m
-                                                        and ' 100' not in m
-                                                        and ' per ' not in m else None)
-
-        metric_explorer.add_scatter(x=value_world.index, y=value_world, name='World', line=dict(dash='dash'))
+        update_traces(metric_explorer, traces, title=m)
+        return traces
 
 
 metric_selector.observe(update_plot, names="value")
+grouping_selector.observe(update_plot, names="value")
 
-display(metric_selector)
+display(widgets.HBox([metric_selector, grouping_selector]))
 update_plot(None)
 display(metric_explorer)
 # -
 
+# The World Bank publishes new values, and revises the recent ones, every year. Set `refresh_data` to `True` to download only the last few years of every indicator, and update the cache, the derived metrics and the explorer for the indicators that changed.
+
+# +
+refresh_data = False
+
+if refresh_data:
+    changed = refresh(indicators, 'world_bank_indicators.hdf')
+    if changed:
+        # Only the indicators that changed are read again from the cache
+        changed = world_bank_data.update(
+            reload(world_bank_data.data, 'world_bank_indicators.hdf', indicators, changed), changed)
+        metric_store.update(world_bank_data, changed)
+        group_store.update(world_bank_data, changed)
+        update_plot(None)
+# -
+
 
 # # A few plots
 
@@ -170,9 +217,12 @@ display(metric_explorer)
 data = []
 
 
+@profiler.instrument
 def add_line(full_name, legend_name, scatter_or_bar=go.Scatter, **kwargs):
-    value = world_bank_data.loc['World'][full_name].dropna()
-    data.append(scatter_or_bar(x=value.index.date, y=value, name=legend_name, **kwargs))
+    value = world(full_name)
+    trace = scatter_or_bar(name=legend_name, **xy(value, max_points), **kwargs)
+    data.append(trace)
+    return trace
 
 
 add_line('Total greenhouse gas emissions (kt of CO2 equivalent)', 'Total', line=dict(dash='dash'))
@@ -181,7 +231,7 @@ add_line('Nitrous oxide emissions (thousand metric tons of CO2 equivalent)', 'Ni
 add_line('Methane emissions (kt of CO2 equivalent)', 'Methane', stackgroup='ghg')
 
 layout = go.Layout(title='Greenhouse gas emissions', barmode='stack',
-                   yaxis=dict(title='CO2 equivalent (kt)'))
+                   xaxis=DATE_AXIS, yaxis=dict(title='CO2 equivalent (kt)'))
 
 offline.iplot(go.Figure(data=data, layout=layout), show_link=False)
 # -
@@ -190,38 +240,19 @@ offline.iplot(go.Figure(data=data, layout=layout), show_link=False)
 
 # CO2 emissions increase at a larger pace than population.
 
-metric_name = 'Population, total'
-metric = world_bank_data[metric_name].dropna()
-data = [go.Scatter(x=metric.loc[region].index.date, y=metric.loc[region], name=region,
-                   stackgroup='World') for region in zones]
-add_line(metric_name, 'Total', line=dict(dash='dash'))
-offline.iplot(go.Figure(data=data,
-                        layout=go.Layout(
-                            title=metric_name,
-                            yaxis=dict(title='Population'))), show_link=False)
+offline.iplot(figure('Population, total', yaxis=dict(title='Population')), show_link=False)
+
+offline.iplot(figure('CO2 emissions per capita (t)'), show_link=False)
 
 # ## Gross domestic product
 
-metric_name = 'GDP (constant 2010 US$)'
-metric = world_bank_data[metric_name].dropna()
-data = [go.Scatter(x=metric.loc[region].index.date, y=metric.loc[region], name=region,
-                   stackgroup='World') for region in zones]
-add_line(metric_name, 'Total', line=dict(dash='dash'))
-offline.iplot(go.Figure(data=data,
-                        layout=go.Layout(
-                            title=metric_name)), show_link=False)
+offline.iplot(figure('GDP (constant 2010 US$)'), show_link=False)
 
 # ## CO2 emissions versus GDP
 
 # Over time, CO2 emissions to create a value of \$1 tend to decrease: production becomes more CO2 efficient over time. But we need to innovate even more to actually decrease the CO2 emissions!
 
-metric_name = 'CO2 emissions (kg per 2010 US$ of GDP)'
-metric = world_bank_data[metric_name].dropna()
-data = [go.Scatter(x=metric.loc[region].index.date, y=metric.loc[region], name=region) for region in zones]
-add_line(metric_name, 'Total', line=dict(dash='dash'))
-offline.iplot(go.Figure(data=data,
-                        layout=go.Layout(
-                            title=metric_name)), show_link=False)
+offline.iplot(figure('CO2 emissions (kg per 2010 US$ of GDP)'), show_link=False)
 
 # # What can I do?
 #
@@ -243,4 +274,9 @@ offline.iplot(go.Figure(data=data,
 #
 # Identifying more efficient CO2 processes could allow to preserve growth, and still reduce emissions.
 
+# # Profiling
+
+# When the profiler is enabled, this table shows how many times the data and plotting functions were called, how long they took, the size of the data they sent to the plots, and how often the views and the figures were already in the cache.
 
+# + tags=["run-last"]
+profiler.dashboard()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""Benchmark the data path of the Greenhouse gas emissions notebook: load, derive, pivot, slice and plot.
+
+Each stage is timed (best of --repeat runs) and its peak memory allocation is measured with
+tracemalloc, on the indicator cache and on synthetic versions of it with more countries and more
+indicators. Everything runs offline. Example:
+
+    python benchmark.py world_bank_indicators.hdf --scale 1x1 10x1 1x10 10x10 100x1 --json benchmark.json
+
+The default scales go up to 100 times more countries (1.5 million rows). 100 times more indicators
+(--scale 1x100, 2000 indicators) is not in the defaults: writing the 2000 keys of its HDF cache
+takes about two minutes, more than all the other scales together.
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+from time import perf_counter
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+from world_bank import load_cache, download_once, LocalBackend, MetricStore
+from metrics import DerivedColumns, is_additive
+from plotting import FigureBuilder, clear_figures, update_traces, xy, DATE_AXIS
+from render_figures import ZONES
+
+
+def scaled(data, countries=1, indicators=1):
+    """A synthetic version of 'data', with 'countries' times more countries and 'indicators' times
+    more indicators. The original countries and indicators are kept, so the World and the regions
+    are still available."""
+    data = pd.concat([data] + [data.rename(index=lambda country: '{} #{}'.format(country, i), level=0)
+                               for i in range(1, countries)])
+
+    columns = {}
+    for j in range(indicators):
+        for name in data:
+            columns[name if j == 0 else '{} #{}'.format(name, j)] = data[name] * (1 + j / 100.)
+
+    return pd.DataFrame(columns).sort_index()
+
+
+def measure(func, repeat=3):
+    """Best time, in seconds, and peak memory allocation, in bytes, of func()"""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(times), peak
+
+
+def update_all_plots(store, metrics):
+    """What the metric explorer does when each metric is selected in turn"""
+    figure = go.Figure(layout=dict(xaxis=DATE_AXIS))
+    for m in metrics:
+        value_region = store.regions(m)
+        traces = [dict(name=region, stackgroup=m if is_additive(m, store) else None, **xy(value_region[region]))
+                  for region in store.zones]
+        traces.append(dict(name='World', line=dict(dash='dash'), **xy(store.world(m))))
+        update_traces(figure, traces, title=m)
+
+
+def build_all_figures(store, metrics):
+    """Build, and serialize, the per-region figure of every metric. Returns the payload size, in bytes"""
+    clear_figures()
+    figures = FigureBuilder(store)
+    return sum(len(figures.figure(m).to_json()) for m in metrics)
+
+
+def benchmark(data, zones, repeat=3):
+    """Time and peak memory of every stage of the data path, for the given indicators"""
+    path = tempfile.mkdtemp()
+    try:
+        cache = os.path.join(path, 'indicators.hdf')
+        indicators = {'BENCH.{}'.format(i): name for i, name in enumerate(data)}
+        download_once(indicators, cache, backend=LocalBackend(data))
+        columns = DerivedColumns(data)
+        metrics = list(columns)
+        store = MetricStore(columns, zones)
+
+        def views(kind):
+            # A new store, on the derived columns that were already computed: the world and regions
+            # stages time the pivot of every metric, and not the lookup of views built earlier
+            fresh = MetricStore(columns, zones)
+            return [getattr(fresh, kind)(m) for m in metrics]
+
+        def pivot():
+            fresh = MetricStore(DerivedColumns(data), zones)
+            for m in metrics:
+                fresh.world(m)
+                fresh.regions(m)
+
+        pivot()
+        views('world')
+        stages = [('load (cache hit)', lambda: download_once(indicators, cache)),
+                  ('load (compact)', lambda: download_once(indicators, cache, compact=True)),
+                  ('load (compact, float32)', lambda: download_once(indicators, cache, compact=True,
+                                                                    dtype=np.float32)),
+                  ('pivot (first access)', pivot),
+                  ('world', lambda: views('world')),
+                  ('regions', lambda: views('regions')),
+                  ('update_plot', lambda: update_all_plots(store, metrics)),
+                  ('figures', lambda: build_all_figures(store, metrics))]
+
+        results = []
+        for stage, func in stages:
+            seconds, peak = measure(func, repeat)
+            results.append(dict(stage=stage, seconds=seconds, peak_bytes=peak))
+
+        results[-1]['payload_bytes'] = build_all_figures(store, metrics)
+        return results
+    finally:
+        shutil.rmtree(path)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cache', nargs='?', default='world_bank_indicators.hdf', help='Indicator cache')
+    parser.add_argument('--scale', nargs='+', default=['1x1', '10x1', '1x10', '10x10', '100x1'],
+                        help="Scale factors, as '<countries>x<indicators>'")
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per stage')
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args(args)
+
+    data = load_cache(args.cache)
+    report = []
+    for scale in args.scale:
+        countries, indicators = (int(factor) for factor in scale.split('x'))
+        sample = scaled(data, countries, indicators)
+        print('{} ({} rows, {} indicators)'.format(scale, len(sample), len(sample.columns)))
+        for result in benchmark(sample, ZONES, args.repeat):
+            result['scale'] = scale
+            report.append(result)
+            print('  {:24s}{:10.4f}s{:10.1f} MB'.format(result['stage'], result['seconds'],
+                                                        result['peak_bytes'] / 2. ** 20))
+
+    if args.json:
+        with open(args.json, 'w') as fp:
+            json.dump(report, fp, indent=1)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
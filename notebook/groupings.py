@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""Metrics aggregated over custom groups of countries: the G7, the European Union, income levels...
+
+The World Bank provides aggregates for its own regions only. Here a `Grouping` maps group names to
+lists of countries, and `GroupStore` turns it into a sparse (group, country) membership matrix.
+The value of a metric for every group and date is then obtained with a single matrix product,
+on the (country, date) array of the metric. Missing values are handled as follows:
+- additive metrics are summed over the countries of the group, and have no value at the dates
+  where one of them, or more than a fraction 1 - 'additive_coverage' of them, have no value.
+  (Summing over whichever countries have a value would make totals, and their growth rates,
+  jump when a country enters the data),
+- the other indicators are averaged over the countries that have a value, weighted as in
+  `metrics.WEIGHTS` (e.g. percentages of the land area by the land area),
+- ratios are the ratio of the sums of their numerator and denominator, over the countries where
+  both are known; growth rates and rolling averages are computed on the aggregates of their input.
+Otherwise, a group has no value at a given date when none of its countries, or less than a fraction
+'min_coverage' of them, have a value."""
+
+import warnings
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from metrics import Ratio, RowGroups, WEIGHTS, is_additive
+
+G7 = ['Canada', 'France', 'Germany', 'Italy', 'Japan', 'United Kingdom', 'United States']
+
+EUROPEAN_UNION = ['Austria', 'Belgium', 'Bulgaria', 'Croatia', 'Cyprus', 'Czech Republic', 'Denmark', 'Estonia',
+                  'Finland', 'France', 'Germany', 'Greece', 'Hungary', 'Ireland', 'Italy', 'Latvia', 'Lithuania',
+                  'Luxembourg', 'Malta', 'Netherlands', 'Poland', 'Portugal', 'Romania', 'Slovak Republic',
+                  'Slovenia', 'Spain', 'Sweden', 'United Kingdom']
+
+G20 = G7 + ['Argentina', 'Australia', 'Brazil', 'China', 'India', 'Indonesia', 'Korea, Rep.', 'Mexico',
+            'Russian Federation', 'Saudi Arabia', 'South Africa', 'Turkey']
+
+
+class Grouping(object):
+    """Named groups of countries. A country can belong to several groups, or to none"""
+
+    def __init__(self, name, groups):
+        self.name = name
+        self.groups = OrderedDict(groups)
+
+    @property
+    def disjoint(self):
+        """Is every country in at most one group? (Only then can additive metrics be stacked)"""
+        members = [country for countries in self.groups.values() for country in countries]
+        return len(members) == len(set(members))
+
+    def matrix(self, countries):
+        """The sparse (group, country) membership matrix, for the given list of countries"""
+        position = pd.Index(countries).get_indexer
+        rows, columns = [], []
+        for i, members in enumerate(self.groups.values()):
+            found = position(pd.Index(members))
+            if (found < 0).any():
+                warnings.warn('{}: no data for {}'.format(
+                    self.name, ', '.join(np.asarray(members)[found < 0])))
+            columns.extend(found[found >= 0])
+            rows.extend([i] * int((found >= 0).sum()))
+        return sparse.csr_matrix((np.ones(len(rows)), (rows, columns)), shape=(len(self.groups), len(countries)))
+
+    def __repr__(self):
+        return '<Grouping {}: {} groups>'.format(self.name, len(self.groups))
+
+
+def world_bank_grouping(field='incomeLevel', name=None):
+    """A grouping of the World Bank countries by 'incomeLevel', 'region' or 'lendingType', from the API"""
+    import wbdata
+    get_countries = getattr(wbdata, 'get_countries', None) or wbdata.get_country
+    groups = OrderedDict()
+    for country in get_countries():
+        group = country[field]['value'].strip()
+        if country['region']['value'] != 'Aggregates' and group:
+            groups.setdefault(group, []).append(country['name'])
+    return Grouping(name or field, groups)
+
+
+# Groupings that do not require the World Bank API
+GROUPINGS = [Grouping('G20', [('G7', G7), ('Other G20 countries', G20[len(G7):])]),
+             Grouping('European Union', [('European Union', EUROPEAN_UNION)])]
+
+
+class GroupStore(object):
+    """Values of the metrics in 'data' (a frame, or `metrics.DerivedColumns`), aggregated over the groups
+    of every grouping.
+
+    The (country, date) array of a metric is built once, and the aggregates are cached per metric
+    and grouping, until the metric changes (see `update`). 'version' identifies the data, as for
+    `MetricStore`."""
+
+    def __init__(self, data, groupings=GROUPINGS, weights=WEIGHTS, min_coverage=0., additive_coverage=1.):
+        self.groupings = OrderedDict((grouping.name, grouping) for grouping in groupings)
+        self.weights = weights
+        self.min_coverage = min_coverage
+        self.additive_coverage = additive_coverage
+        self.version = 0
+        self._reset(data)
+
+    def _reset(self, data):
+        self.data = data
+        index = data.index
+        self.countries = index.levels[0]
+        self._country = np.asarray(index.codes[0])
+        dates, self._date = np.unique(index.get_level_values(1).values, return_inverse=True)
+        self.dates = pd.DatetimeIndex(dates, name=index.names[1])
+
+        self._matrices = {}
+        self._arrays = {}
+        self._groups = {}
+
+    def update(self, data, changed=None):
+        """Use the new 'data', in which only the metrics in 'changed' (by default, all) differ.
+        Derived metrics are not updated with their inputs: use the metrics returned by
+        `DerivedColumns.update`."""
+        if changed is None or not data.index.equals(self.data.index):
+            self._reset(data)
+        else:
+            self.data = data
+            for metric in changed:
+                self._arrays.pop(metric, None)
+            for key in [key for key in self._groups if key[0] in changed]:
+                del self._groups[key]
+        self.version += 1
+
+    def add(self, grouping):
+        """Add, or replace, a grouping"""
+        self.groupings[grouping.name] = grouping
+        self._matrices.pop(grouping.name, None)
+        for key in [key for key in self._groups if key[1] == grouping.name]:
+            del self._groups[key]
+
+    def _matrix(self, grouping):
+        if grouping not in self._matrices:
+            matrix = self.groupings[grouping].matrix(self.countries)
+            self._matrices[grouping] = matrix, np.asarray(matrix.sum(axis=1))
+        return self._matrices[grouping]
+
+    def _array(self, metric):
+        """The (country, date) array of a metric"""
+        if metric not in self._arrays:
+            column = self.data[metric]
+            n = len(column)
+            values = np.full((len(self.countries), len(self.dates)), np.nan)
+            values[self._country[:n], self._date[:n]] = column.values
+            self._arrays[metric] = values
+        return self._arrays[metric]
+
+    def _sum(self, grouping, values, known, coverage=None):
+        """Sum of the known values, per group and date, or NaN when less than a fraction 'coverage'
+        (by default, 'min_coverage') of the values are known"""
+        matrix, size = self._matrix(grouping)
+        total = matrix.dot(np.where(known, values, 0.))
+        count = matrix.dot(known.astype(np.float64))
+        coverage = self.min_coverage if coverage is None else coverage
+        total[(count == 0) | (count < coverage * size)] = np.nan
+        return total
+
+    def _aggregate(self, metric, grouping):
+        """The (group, date) array of a metric"""
+        derived = getattr(self.data, 'derived', {}).get(metric)
+        if isinstance(derived, Ratio):
+            numerator, denominator = (self._array(name) for name in derived.inputs)
+            known = ~np.isnan(numerator) & ~np.isnan(denominator)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = derived.scale * self._sum(grouping, numerator, known) / self._sum(grouping, denominator, known)
+            values[~np.isfinite(values)] = np.nan
+            return values
+
+        if derived is not None:
+            inputs = {name: self._aggregate(name, grouping).ravel() for name in derived.inputs}
+            index = pd.MultiIndex.from_product([list(self.groupings[grouping].groups), self.dates])
+            return derived.compute(inputs, RowGroups(index)).reshape(len(index.levels[0]), len(self.dates))
+
+        values = self._array(metric)
+        known = ~np.isnan(values)
+        if is_additive(metric, self.data):
+            return self._sum(grouping, values, known, self.additive_coverage)
+
+        weights = self._array(self.weights[metric]) if metric in self.weights else np.ones_like(values)
+        known &= ~np.isnan(weights)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = self._sum(grouping, values * weights, known) / self._sum(grouping, weights, known)
+        values[~np.isfinite(values)] = np.nan
+        return values
+
+    def groups(self, metric, grouping):
+        """Value of the desired metric, per group (column) of the grouping, indexed by date"""
+        key = metric, grouping
+        if key not in self._groups:
+            values = self._aggregate(metric, grouping).T
+            rows = ~np.isnan(values).all(axis=1)
+            self._groups[key] = pd.DataFrame(values[rows], index=self.dates[rows],
+                                             columns=pd.Index(list(self.groupings[grouping].groups), name=grouping))
+        return self._groups[key]
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""Metrics derived from the World Bank indicators: ratios, annual growth rates and rolling averages.
+
+Derived metrics are computed on whole columns, for every country and aggregate at once, with
+array operations. `DerivedColumns` adds them to the indicator frame (or to a lazy `IndicatorColumns`)
+as ordinary columns, computed when they are first accessed and then kept in memory with the raw
+indicators. Every metric is also flagged as additive or not: the values of additive metrics, like
+population or emissions, can be summed over countries or regions, and their regions are stacked in
+the plots. Ratios, percentages and indices are not additive. The additivity of an indicator follows
+from the unit in its name (see `has_additive_unit`), so renamed or new indicators keep it."""
+
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+# Units (in the World Bank indicator names) of quantities that are totals over a country...
+ADDITIVE_UNITS = ['(kt', '(thousand metric tons', 'us$)', '(sq. km)', ', total']
+
+# ... unless the name also has one of these, which denote ratios, shares and indices
+NON_ADDITIVE_UNITS = ['%', ' per ', 'index', '= 100']
+
+
+def has_additive_unit(name):
+    """Is the indicator with that name a total over a country, like 'CO2 emissions (kt)' or 'GDP
+    (current US$)', rather than a ratio, a percentage or an index, like 'CO2 emissions (kg per 2010 US$
+    of GDP)' or 'Arable land (% of land area)'?"""
+    name = name.lower()
+    if any(unit in name for unit in NON_ADDITIVE_UNITS):
+        return False
+    return any(unit in name for unit in ADDITIVE_UNITS)
+
+
+def is_additive(name, data=None):
+    """Can the values of that metric be summed over countries or regions (and its regions be stacked)?
+    As declared by 'data', when it has an 'additive' method (e.g. a `DerivedColumns` or a
+    `world_bank.MetricStore`), or else as given by the unit in its name"""
+    if hasattr(data, 'additive'):
+        return data.additive(name)
+    return has_additive_unit(name)
+
+
+# Weights for the average of the other indicators over a group of countries (see `groupings`)
+WEIGHTS = {
+    'Arable land (% of land area)': 'Land area (sq. km)',
+    'CO2 emissions from manufacturing industries and construction (% of total fuel combustion)': 'CO2 emissions (kt)',
+    'CO2 emissions from transport (% of total fuel combustion)': 'CO2 emissions (kt)',
+    'CO2 emissions from gaseous fuel consumption (% of total)': 'CO2 emissions (kt)',
+    'CO2 emissions (kg per 2010 US$ of GDP)': 'GDP (constant 2010 US$)'}
+
+
+class Ratio(object):
+    """The ratio of two metrics, times 'scale'"""
+    additive = False
+
+    def __init__(self, name, numerator, denominator, scale=1.):
+        self.name = name
+        self.inputs = [numerator, denominator]
+        self.scale = scale
+
+    def compute(self, columns, groups):
+        numerator, denominator = (columns[name] for name in self.inputs)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            values = numerator * self.scale / denominator
+        values[~np.isfinite(values)] = np.nan
+        return values
+
+
+class Growth(object):
+    """The annual growth rate of a metric, in percent. Missing when the previous year is missing"""
+    additive = False
+
+    def __init__(self, name, metric):
+        self.name = name
+        self.inputs = [metric]
+
+    def compute(self, columns, groups):
+        values = columns[self.inputs[0]][groups.order]
+        growth = np.full(len(values), np.nan)
+        follows = (groups.country[1:] == groups.country[:-1]) & (groups.year[1:] == groups.year[:-1] + 1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            growth[1:][follows] = 100. * (values[1:][follows] / values[:-1][follows] - 1.)
+        growth[~np.isfinite(growth)] = np.nan
+        return groups.restore(growth)
+
+
+class RollingMean(object):
+    """The average of a metric over its last 'window' observations (at most) for the same country.
+    Additive if the metric is (the 'additive' attribute is None, and resolved by `DerivedColumns`)"""
+    additive = None
+
+    def __init__(self, name, metric, window):
+        self.name = name
+        self.inputs = [metric]
+        self.window = window
+
+    def compute(self, columns, groups):
+        values = columns[self.inputs[0]][groups.order]
+        known = ~np.isnan(values)
+        total = np.concatenate([[0.], np.cumsum(np.where(known, values, 0.))])
+        count = np.concatenate([[0], np.cumsum(known)])
+
+        end = np.arange(1, len(values) + 1)
+        start = np.maximum(end - self.window, groups.start)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = (total[end] - total[start]) / (count[end] - count[start])
+        mean[~known] = np.nan
+        return groups.restore(mean)
+
+
+# Metrics that compare the emissions with the population, the surface and the economy
+DERIVED = [
+    Ratio('CO2 emissions per capita (t)', 'CO2 emissions (kt)', 'Population, total', 1e3),
+    Ratio('Greenhouse gas emissions per capita (t of CO2 equivalent)',
+          'Total greenhouse gas emissions (kt of CO2 equivalent)', 'Population, total', 1e3),
+    Ratio('CO2 emissions per sq. km (t)', 'CO2 emissions (kt)', 'Surface area (sq. km)', 1e3),
+    Ratio('CO2 emissions per GDP (kg per constant 2010 US$)', 'CO2 emissions (kt)', 'GDP (constant 2010 US$)', 1e6),
+    Ratio('GDP per capita (constant 2010 US$)', 'GDP (constant 2010 US$)', 'Population, total'),
+    Ratio('Population density (people per sq. km of land area)', 'Population, total', 'Land area (sq. km)'),
+    Growth('Population growth (annual %)', 'Population, total'),
+    Growth('GDP growth (annual %)', 'GDP (constant 2010 US$)'),
+    Growth('CO2 emissions growth (annual %)', 'CO2 emissions (kt)'),
+    RollingMean('CO2 emissions, 5-year average (kt)', 'CO2 emissions (kt)', 5)]
+
+
+def derivable(names, derived=DERIVED):
+    """The derived metrics that can be computed from the given indicators"""
+    available = set(names) | set(metric.name for metric in derived)
+    return [metric for metric in derived if all(name in available for name in metric.inputs)]
+
+
+class RowGroups(object):
+    """The rows of an index sorted by country and date, and, in that order, the country, year and
+    position of the first row of the country, for every row"""
+
+    def __init__(self, index):
+        country = np.asarray(index.codes[0])
+        year = np.asarray(index.get_level_values(1).year)
+        self.order = np.lexsort((year, country))
+        self.country = country[self.order]
+        self.year = year[self.order]
+        first = np.concatenate([[True], self.country[1:] != self.country[:-1]])
+        self.start = np.maximum.accumulate(np.where(first, np.arange(len(first)), 0))
+
+    def restore(self, values):
+        """Values in the original order of the index"""
+        restored = np.empty_like(values)
+        restored[self.order] = values
+        return restored
+
+
+class DerivedColumns(object):
+    """Frame-like, read-only view of the indicators in 'data', plus the 'derived' metrics.
+
+    'data' is a DataFrame or an `IndicatorColumns` proxy, indexed by country and date. Derived
+    metrics are computed on first access, on the full index of 'data', and cached. They can use
+    other derived metrics. 'additive' is the set of the raw indicators that are additive; by default,
+    the indicators with an additive unit (see `has_additive_unit`)."""
+
+    def __init__(self, data, derived=DERIVED, additive=None):
+        self.data = data
+        self.derived = OrderedDict((metric.name, metric) for metric in derivable(data, derived))
+        self.additive_indicators = None if additive is None else set(additive)
+        self._columns = {}
+        self._groups = None
+
+    @property
+    def columns(self):
+        return pd.Index(list(self))
+
+    @property
+    def index(self):
+        return self.data.index
+
+    @property
+    def loc(self):
+        return _DerivedIndexer(self)
+
+    def __iter__(self):
+        for name in self.data:
+            yield name
+        for name in self.derived:
+            yield name
+
+    def __len__(self):
+        return len(self.data.columns) + len(self.derived)
+
+    def __contains__(self, name):
+        return name in self.derived or name in self.data
+
+    def __getitem__(self, name):
+        if name not in self.derived:
+            return self.data[name]
+        if name not in self._columns:
+            metric = self.derived[name]
+            if self._groups is None:
+                self._groups = RowGroups(self.index)
+            values = metric.compute({input: self.values(input) for input in metric.inputs}, self._groups)
+            self._columns[name] = pd.Series(values, index=self.index, name=name)
+        return self._columns[name]
+
+    def values(self, name):
+        """The values of a metric, as an array aligned on the index"""
+        if name in self.derived:
+            return self[name].values
+
+        column = self.data[name]
+        if len(column) < len(self.index):
+            # The columns of a columnar cache can be shorter than the shared index
+            return np.concatenate([column.values, np.full(len(self.index) - len(column), np.nan)])
+        return np.asarray(column.values, dtype=np.float64)
+
+    def update(self, data, changed=None):
+        """Use the new 'data', in which only the indicators in 'changed' (by default, all) differ.
+        Returns the metrics that changed, including the derived metrics that depend on them."""
+        changed = set(data if changed is None else changed)
+        if not data.index.equals(self.index):
+            self._groups = None
+            changed |= set(self.derived)
+        self.data = data
+
+        dependent = True
+        while dependent:
+            dependent = [metric.name for metric in self.derived.values()
+                         if metric.name not in changed and any(name in changed for name in metric.inputs)]
+            changed.update(dependent)
+        for name in changed:
+            self._columns.pop(name, None)
+        return changed
+
+    def additive(self, name):
+        """Can the values of that metric be summed over countries or regions?"""
+        if name not in self.derived:
+            if self.additive_indicators is None:
+                return has_additive_unit(name)
+            return name in self.additive_indicators
+        metric = self.derived[name]
+        if metric.additive is None:
+            return all(self.additive(input) for input in metric.inputs)
+        return metric.additive
+
+    def __repr__(self):
+        return '<DerivedColumns: {} indicators, {} derived metrics ({} computed)>'.format(
+            len(self.data.columns), len(self.derived), len(self._columns))
+
+
+class _DerivedIndexer(object):
+    """The `loc` attribute of `DerivedColumns`. The derived metrics are computed on the rows of the
+    selected countries only, which hold every date of these countries"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, country):
+        raw = self.columns.data.loc[[country] if np.ndim(country) == 0 else country]
+        groups = RowGroups(raw.index)
+        values = {}
+
+        def compute(name):
+            if name not in values:
+                if name in self.columns.derived:
+                    metric = self.columns.derived[name]
+                    values[name] = metric.compute({input: compute(input) for input in metric.inputs}, groups)
+                else:
+                    values[name] = np.asarray(raw[name].values, dtype=np.float64)
+            return values[name]
+
+        frame = raw.assign(**{name: compute(name) for name in self.columns.derived})
+        if np.ndim(country) == 0:
+            return frame.loc[country]
+        return frame
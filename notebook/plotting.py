@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""Plotly helpers for the Greenhouse gas emissions notebook"""
+
+import asyncio
+import functools
+import hashlib
+import json
+import numpy as np
+import plotly.graph_objs as go
+
+# Layout for an x axis of numeric (epoch, in milliseconds) timestamps, see `xy`
+DATE_AXIS = dict(type='date')
+
+# The trace properties that `update_traces` resets when a new trace does not set them: a trace that
+# was a stacked region, or the dashed World line, can become the other kind of trace
+TRACE_DEFAULTS = dict(stackgroup=None, line=dict(dash=None))
+
+# The figures built by every `FigureBuilder`, indexed by metric, layout and content of the data
+_built_figures = {}
+
+
+def debounce(wait):
+    """Decorator that postpones the calls to a function until no new call was made for 'wait' seconds.
+
+    Only the last call is executed: when an ipywidgets control changes quickly (say, a Dropdown
+    browsed with the keyboard), the intermediate values are skipped. The call is scheduled on the
+    kernel's event loop, so it runs in the same thread as the widget callbacks. Without a running
+    event loop (e.g. in a script), the function is called immediately."""
+
+    def decorator(func):
+        pending = []
+
+        @functools.wraps(func)
+        def debounced(*args, **kwargs):
+            while pending:
+                pending.pop().cancel()
+
+            try:
+                loop = asyncio.get_event_loop()
+            except RuntimeError:
+                loop = None
+            if loop is None or not loop.is_running():
+                return func(*args, **kwargs)
+
+            pending.append(loop.call_later(wait, functools.partial(func, *args, **kwargs)))
+
+        return debounced
+
+    return decorator
+
+
+def update_traces(figure, traces, **layout):
+    """Update the traces and the layout of a FigureWidget in place, in a single `batch_update`.
+
+    'traces' is a list of dicts with the new properties of each trace. Existing traces are
+    updated rather than recreated; traces are added or removed only when their number changes.
+    `trace.update` merges the new properties into the old ones, so the properties in
+    `TRACE_DEFAULTS` that a trace does not set are reset."""
+    with figure.batch_update():
+        for trace, props in zip(figure.data, traces):
+            trace.update(dict(TRACE_DEFAULTS, **props))
+        figure.layout.update(layout)
+
+    if len(traces) < len(figure.data):
+        figure.data = figure.data[:len(traces)]
+    elif len(traces) > len(figure.data):
+        figure.add_traces([dict(type='scatter', **props) for props in traces[len(figure.data):]])
+
+
+def lttb(x, y, max_points):
+    """Downsample (x, y) to 'max_points' points with the Largest-Triangle-Three-Buckets algorithm.
+
+    The first and last points are kept. The other points are split into max_points - 2 buckets,
+    and in each bucket we keep the point that forms the largest triangle with the point kept in
+    the previous bucket and the average of the next bucket."""
+    n = len(x)
+    if max_points >= n or max_points < 3:
+        return x, y
+
+    edges = np.linspace(1, n - 1, max_points - 1).astype(int)
+    kept = np.zeros(max_points, dtype=int)
+    kept[-1] = n - 1
+
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x, avg_y = x[end:next_end].mean(), y[end:next_end].mean()
+
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(area))
+        kept[i + 1] = a
+
+    return x[kept], y[kept]
+
+
+def xy(value, max_points=None):
+    """The x and y arguments of a plotly trace for a series indexed by date.
+
+    Dates are converted to numeric timestamps (milliseconds since epoch) and values to float64
+    arrays, which plotly serializes as typed binary arrays rather than as one JSON item per point
+    (use `DATE_AXIS` for the x axis). With 'max_points', series that have more points than that
+    are downsampled with `lttb`, after removing the missing values."""
+    x = np.asarray(value.index.values).astype('datetime64[ms]').astype(np.int64).astype(np.float64)
+    y = np.asarray(value.values, dtype=np.float64)
+
+    if max_points and len(x) > max_points:
+        finite = np.isfinite(y)
+        x, y = lttb(x[finite], y[finite], max_points)
+
+    return dict(x=x, y=y)
+
+
+def clear_figures():
+    """Forget the figures built by every `FigureBuilder`"""
+    _built_figures.clear()
+
+
+class FigureBuilder(object):
+    """Figures of a metric per world region, stacked or not, with the World as a dashed line.
+
+    The figures are built from the views of a `MetricStore`, and cached by metric, layout and
+    version of the metric, so that updating the data of other metrics does not rebuild unchanged
+    figures. They are also cached at the module level by a hash of the data they show: running the
+    notebook again, with a new store and a new builder, does not rebuild them either."""
+
+    def __init__(self, store, max_points=None):
+        self.store = store
+        self.max_points = max_points
+        self.hits = 0
+        self.misses = 0
+        self._figures = {}
+
+    def _digest(self, metric):
+        """A hash of the values, dates and zones shown in the figure of a metric"""
+        digest = hashlib.sha1(json.dumps([metric, self.store.zones]).encode('utf-8'))
+        for value in (self.store.regions(metric), self.store.world(metric)):
+            digest.update(np.ascontiguousarray(value.values, dtype=np.float64).tobytes())
+            digest.update(np.asarray(value.index.values).astype('datetime64[ns]').tobytes())
+        return digest.hexdigest()
+
+    def figure(self, metric, stacked=None, **layout):
+        """The figure for the given metric; 'layout' is passed to `go.Layout`. The regions are
+        stacked when 'stacked' is True, or, by default, when the metric is additive."""
+        if stacked is None:
+            stacked = self.store.additive(metric)
+        key = (metric, stacked, json.dumps(layout, sort_keys=True), self.store.versions[metric])
+        if key in self._figures:
+            self.hits += 1
+            return self._figures[key]
+
+        for outdated in [other for other in self._figures if other[0] == metric and other[3] != key[3]]:
+            del self._figures[outdated]
+        digest = self._digest(metric)
+        shared = key[:3] + (self.max_points, digest)
+        if shared in _built_figures:
+            self.hits += 1
+        else:
+            self.misses += 1
+            for outdated in [other for other in _built_figures if other[0] == metric and other[4] != digest]:
+                del _built_figures[outdated]
+            value_region = self.store.regions(metric)
+            data = [go.Scatter(name=region, stackgroup='World' if stacked else None,
+                               **xy(value_region[region].dropna(), self.max_points))
+                    for region in self.store.zones]
+            data.append(go.Scatter(name='Total', line=dict(dash='dash'),
+                                   **xy(self.store.world(metric), self.max_points)))
+            _built_figures[shared] = go.Figure(data=data,
+                                               layout=go.Layout(title=metric, xaxis=DATE_AXIS, **layout))
+        self._figures[key] = _built_figures[shared]
+        return self._figures[key]
+
+    def figures(self, metrics, stacked=None, **layout):
+        """The figures for a list of metrics, indexed by metric. Each figure is built (or found in
+        the caches) separately, from the slice of its metric in the store"""
+        return {metric: self.figure(metric, stacked, **layout) for metric in metrics}
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""Opt-in instrumentation of the data and plotting functions of the Greenhouse gas emissions notebook.
+
+`Profiler.instrument` wraps a function, and records, for every call, the wall time, the size of
+the payload it produced (e.g. the traces sent to the browser) and the number of cache hits and
+misses it caused. When the profiler is disabled, functions are returned unchanged, at no cost.
+Enable it with `Profiler(enabled=True)`, or with the environment variable NOTEBOOK_PROFILE=1.
+
+The statistics are available as a DataFrame (`summary`), as a small widget (`dashboard`), and, with
+'log', as a JSON-lines file with one record per call, e.g. to profile real user sessions:
+
+    pd.read_json('profile.jsonl', lines=True).groupby('function').seconds.describe()
+"""
+
+import os
+import json
+import uuid
+import functools
+from time import perf_counter
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+
+def payload_bytes(obj):
+    """An estimate of the size of an object, once sent to the browser: the size of the arrays (or of
+    the objects with an 'nbytes', like `world_bank.CompactFrame`), and the length of the other values
+    in JSON"""
+    if obj is None:
+        return 0
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, (pd.Series, pd.DataFrame)):
+        return int(np.sum(obj.memory_usage()))
+    if hasattr(obj, 'to_plotly_json'):
+        return payload_bytes(obj.to_plotly_json())
+    if isinstance(obj, dict):
+        return sum(len(str(key)) + payload_bytes(value) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return sum(payload_bytes(value) for value in obj)
+    if hasattr(obj, 'nbytes'):
+        return int(obj.nbytes)
+    return len(json.dumps(obj, default=str))
+
+
+class Profiler(object):
+    """Call counts, wall time, payload and cache hit rates of the instrumented functions"""
+
+    def __init__(self, enabled=None, log=None):
+        if enabled is None:
+            enabled = os.environ.get('NOTEBOOK_PROFILE', '') not in ('', '0')
+        self.enabled = enabled
+        self.log = log
+        self.session = uuid.uuid4().hex[:12]
+        self.stats = OrderedDict()
+        self._html = None
+
+    def instrument(self, func=None, name=None, payload=None, cache=None):
+        """Record the calls to 'func'. Can be used as a decorator, with or without arguments.
+
+        'payload' is a function of the result that returns the payload size in bytes (by default
+        `payload_bytes` of the result), and 'cache' a function that returns the current (hits, misses)
+        counters of the cache used by 'func'."""
+        if func is None:
+            return functools.partial(self.instrument, name=name, payload=payload, cache=cache)
+        if not self.enabled:
+            return func
+
+        name = name or func.__name__
+        payload = payload or payload_bytes
+
+        @functools.wraps(func)
+        def instrumented(*args, **kwargs):
+            before = cache() if cache else (0, 0)
+            start = perf_counter()
+            try:
+                return_value = func(*args, **kwargs)
+            finally:
+                seconds = perf_counter() - start
+            after = cache() if cache else (0, 0)
+            self.record(name, seconds, payload(return_value), after[0] - before[0], after[1] - before[1])
+            return return_value
+
+        return instrumented
+
+    def record(self, name, seconds, payload=0, hits=0, misses=0):
+        """Record one call"""
+        stats = self.stats.setdefault(name, dict(calls=0, seconds=0., max_seconds=0., payload_bytes=0,
+                                                 hits=0, misses=0))
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        stats['payload_bytes'] += payload
+        stats['hits'] += hits
+        stats['misses'] += misses
+
+        if self.log:
+            with open(self.log, 'a') as fp:
+                fp.write(json.dumps(dict(time=pd.Timestamp.now().isoformat(), session=self.session, function=name,
+                                         seconds=seconds, payload_bytes=payload, hits=hits, misses=misses)) + '\n')
+
+    def summary(self):
+        """The statistics of every instrumented function, as a DataFrame"""
+        summary = pd.DataFrame.from_dict(self.stats, orient='index',
+                                         columns=['calls', 'seconds', 'max_seconds', 'payload_bytes', 'hits', 'misses'])
+        summary['mean_seconds'] = summary['seconds'] / summary['calls']
+        lookups = summary['hits'] + summary['misses']
+        summary['hit_rate'] = summary['hits'] / lookups.where(lookups > 0)
+        return summary
+
+    def dashboard(self):
+        """A widget with the summary, and a button to refresh it"""
+        from ipywidgets import widgets
+
+        self._html = widgets.HTML()
+        refresh = widgets.Button(description='Refresh')
+        refresh.on_click(lambda button: self._refresh())
+        self._refresh()
+        return widgets.VBox([refresh, self._html])
+
+    def _refresh(self):
+        if self._html is None:
+            return
+        if not self.stats:
+            self._html.value = '<i>No calls recorded{}</i>'.format('' if self.enabled else ': the profiler is disabled')
+            return
+        self._html.value = self.summary().to_html(float_format='{:.4f}'.format)
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Render the per-region figures of the Greenhouse gas emissions notebook to static files.
+
+The figures are rendered in parallel, in a pool of processes that each load the indicator
+cache just once. Example:
+
+    python render_figures.py world_bank_indicators.hdf --output figures --processes 4
+"""
+
+import os
+import re
+import sys
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import plotly.io as pio
+from world_bank import open_cache, load_cache, MetricStore
+from metrics import DerivedColumns, derivable
+from plotting import FigureBuilder
+
+# The World Bank regions plotted in the notebook, in order of increasing population
+ZONES = ['East Asia & Pacific', 'South Asia', 'Sub-Saharan Africa', 'Europe & Central Asia',
+         'Latin America & Caribbean', 'Middle East & North Africa', 'North America']
+
+_figures = None
+
+
+def _init_worker(cache, zones, max_points):
+    """Load the indicator cache, once per worker process"""
+    global _figures
+    _figures = FigureBuilder(MetricStore(DerivedColumns(load_cache(cache)), zones), max_points)
+
+
+def file_name(metric, fmt):
+    """A file name for the figure of the given metric"""
+    return re.sub(r'[^A-Za-z0-9]+', '_', metric).strip('_') + '.' + fmt
+
+
+def render(metric, output, fmt):
+    """Render the figure for one metric, and return the time this took, in seconds"""
+    start = time.time()
+    fig = _figures.figure(metric)
+    path = os.path.join(output, file_name(metric, fmt))
+    if fmt == 'html':
+        pio.write_html(fig, path, include_plotlyjs='cdn', auto_open=False)
+    else:
+        pio.write_image(fig, path, format=fmt)
+    return time.time() - start
+
+
+def render_figures(cache, metrics=None, output='figures', fmt='html', zones=ZONES, processes=None,
+                   max_points=None):
+    """Render the figures for the given metrics (by default, all the metrics in the cache, and the
+    metrics derived from them), and return the rendering time of each metric"""
+    if not os.path.isdir(output):
+        os.makedirs(output)
+    if metrics is None:
+        metrics = [meta['name'] for meta in open_cache(cache).metadata().values()]
+        metrics += [metric.name for metric in derivable(metrics)]
+
+    with ProcessPoolExecutor(processes, initializer=_init_worker,
+                             initargs=(cache, zones, max_points)) as pool:
+        futures = {metric: pool.submit(render, metric, output, fmt) for metric in metrics}
+        return {metric: future.result() for metric, future in futures.items()}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('cache', help='Indicator cache, as written by download_once')
+    parser.add_argument('--metric', action='append', dest='metrics',
+                        help='Metric to render (repeat for more metrics). Default: all the metrics in the cache, and the derived metrics')
+    parser.add_argument('--output', default='figures', help='Output directory')
+    parser.add_argument('--format', default='html', dest='fmt',
+                        help="'html', or an image format like 'png' or 'svg' (requires kaleido or orca)")
+    parser.add_argument('--zones', nargs='+', default=ZONES, help='Regions, or countries, to plot')
+    parser.add_argument('--processes', type=int, help='Number of worker processes. Default: number of CPUs')
+    parser.add_argument('--max-points', type=int, help='Downsample series that have more points than this')
+    args = parser.parse_args(args)
+
+    start = time.time()
+    timings = render_figures(args.cache, args.metrics, args.output, args.fmt, args.zones, args.processes,
+                             args.max_points)
+
+    for metric, seconds in sorted(timings.items(), key=lambda item: -item[1]):
+        print('{:8.3f}s  {}'.format(seconds, metric))
+    print('Rendered {} figures to {} in {:.1f}s'.format(len(timings), args.output, time.time() - start))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,980 @@
+# -*- coding: utf-8 -*-
+"""World Bank indicators for the Greenhouse gas emissions notebook: local cache, and pivoted views per zone"""
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from metrics import is_additive
+
+
+class WorldBankBackend(object):
+    """Indicators downloaded from the World Bank API, with wbdata"""
+
+    def __init__(self):
+        import wbdata
+        self.wb = wbdata
+
+    def fetch(self, code, name, start=None):
+        """Values of a single indicator, indexed by country and date, from the date 'start' if not None"""
+        if start is None:
+            return self.wb.get_dataframe({code: name}, convert_date=True)[name]
+        return self.wb.get_dataframe({code: name}, convert_date=True,
+                                     data_date=(start.to_pydatetime(), datetime.now()))[name]
+
+
+class LocalBackend(object):
+    """Indicators read from a local frame, or from a HDF file with an 'indicators' frame.
+
+    A stand-in for the World Bank API, to test or benchmark the download path offline.
+    Use 'latency' (in seconds) to simulate the response time of the API."""
+
+    def __init__(self, data, latency=0.):
+        self.data = data
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def fetch(self, code, name, start=None):
+        """Values of a single indicator, indexed by country and date, from the date 'start' if not None"""
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            if not isinstance(self.data, pd.DataFrame):
+                self.data = pd.read_hdf(self.data, 'indicators')
+        if name not in self.data:
+            raise KeyError('Indicator {} ({}) is not available locally'.format(code, name))
+        values = self.data[name].dropna()
+        if start is not None:
+            values = values[values.index.get_level_values(1) >= start]
+        return values
+
+
+def fetch_one(backend, code, name, retries=3, backoff=1., start=None):
+    """Fetch a single indicator (from the date 'start', if not None), and retry with an exponential
+    backoff if that fails.
+
+    A KeyError means that the indicator does not exist, and is not retried."""
+    for attempt in range(retries + 1):
+        try:
+            return backend.fetch(code, name, start).rename(name).sort_index()
+        except KeyError:
+            raise
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def fetch_indicators(indicators, backend=None, max_workers=4, retries=3, backoff=1., starts=None):
+    """Values of the given indicators, fetched concurrently with at most 'max_workers' requests
+    at a time, indexed by indicator code. 'starts' optionally maps indicator codes to the first date
+    to fetch."""
+    backend = backend or WorldBankBackend()
+    starts = starts or {}
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {code: pool.submit(fetch_one, backend, code, name, retries, backoff, starts.get(code))
+                   for code, name in indicators.items()}
+        return {code: future.result() for code, future in futures.items()}
+
+
+def changed_values(current, new):
+    """Which of the 'new' values differ from the 'current' ones (NaN equals NaN)"""
+    return ~((current == new) | (np.isnan(current) & np.isnan(new)))
+
+
+def to_dataframe(values, indicators):
+    """A frame with one column per indicator, indexed by country and date"""
+    return pd.concat([values[code].rename(name) for code, name in indicators.items()], axis=1).sort_index()
+
+
+class HDFCache(object):
+    """World Bank indicators stored in a HDF file, one key per indicator.
+
+    Each indicator is saved under 'indicator/<code>', together with its name, fetch date, last date
+    with a value, and version (incremented every time its values change), so that new indicators can
+    be added to the file without rewriting the existing ones. Files written
+    by the previous version of `download_once`, with all the indicators in a single 'indicators'
+    frame, can still be read."""
+
+    legacy_key = '/indicators'
+
+    def __init__(self, path):
+        self.path = path
+        self._legacy = None
+
+    @staticmethod
+    def key(code):
+        """HDF key for the given indicator code (PyTables does not like dots in node names)"""
+        return '/indicator/' + code.replace('.', '_')
+
+    def _legacy_frame(self, store):
+        if self._legacy is None:
+            self._legacy = store.get(self.legacy_key)
+        return self._legacy
+
+    def metadata(self, indicators=None):
+        """Name, fetch date, version and key of the cached indicators, indexed by indicator code.
+
+        Columns of a legacy 'indicators' frame are reported for the codes in 'indicators'
+        that have the same name (or, without 'indicators', under their name), with the file
+        modification time as the fetch date."""
+        if not os.path.isfile(self.path):
+            return {}
+
+        cached = {}
+        with pd.HDFStore(self.path, 'r') as store:
+            keys = store.keys()
+            for key in keys:
+                if key.startswith('/indicator/'):
+                    meta = dict(store.get_storer(key).attrs.metadata)
+                    meta.setdefault('version', 1)
+                    meta['key'] = key
+                    cached[meta['code']] = meta
+
+            if self.legacy_key in keys:
+                fetched = pd.Timestamp(os.path.getmtime(self.path), unit='s')
+                legacy = self._legacy_frame(store)
+                for code, name in (indicators or {name: name for name in legacy}).items():
+                    if code not in cached and name in legacy:
+                        cached[code] = dict(code=code, name=name, fetched=fetched, version=1, key=self.legacy_key)
+
+        return cached
+
+    def version(self):
+        """A counter that increases every time an indicator in the cache changes"""
+        return sum(meta['version'] for meta in self.metadata().values())
+
+    def read(self, meta):
+        """Values of the indicator described by 'meta', indexed by country and date"""
+        if meta['key'] == self.legacy_key:
+            return self._legacy[meta['name']]
+
+        values = pd.read_hdf(self.path, meta['key']).rename(meta['name'])
+        if not values.index.is_monotonic_increasing:
+            # Updated indicators are HDF tables, to which the changed rows are appended
+            values = values.sort_index()
+        return values
+
+    def write(self, code, name, values, fetched):
+        """Store (or replace) a single indicator. The other keys in the file are not rewritten."""
+        key = self.key(code)
+        with pd.HDFStore(self.path, 'a') as store:
+            version = store.get_storer(key).attrs.metadata.get('version', 1) if key in store else 0
+            store.put(key, values.rename(name))
+            store.get_storer(key).attrs.metadata = dict(code=code, name=name, fetched=fetched, version=version + 1,
+                                                        last=last_date(values))
+
+    @contextmanager
+    def batch(self):
+        """The metadata of an indicator is stored with its values: there is nothing to batch"""
+        yield self
+
+    def upsert(self, code, name, values, fetched, chunk_size=2 ** 16):
+        """Insert new rows, or update existing rows, of a single indicator, and return the number
+        of values that changed. Only the key and the metadata of that indicator are read.
+
+        The first update converts the indicator to a (compressed) HDF table. From then on, the revised
+        rows are deleted from the table, and the changed values are appended to it, 'chunk_size' rows
+        at a time: the rows that did not change are not rewritten."""
+        key = self.key(code)
+        with pd.HDFStore(self.path, 'a', complevel=5, complib='blosc') as store:
+            meta = current = None
+            if key in store:
+                meta = dict(store.get_storer(key).attrs.metadata)
+                current = store.get(key)
+            elif self.legacy_key in store and name in self._legacy_frame(store):
+                meta, current = {}, self._legacy[name]
+
+            if meta is None:
+                store.put(key, values.rename(name))
+                store.get_storer(key).attrs.metadata = dict(code=code, name=name, fetched=fetched, version=1,
+                                                            last=last_date(values))
+                return int(values.notnull().sum())
+
+            positions = current.index.get_indexer(values.index)
+            known = positions >= 0
+            previous = np.full(len(values), np.nan)
+            previous[known] = current.values[positions[known]]
+            changed = changed_values(previous, np.asarray(values.values, dtype=np.float64))
+            if not changed.any():
+                return 0
+
+            # The values column of a table is not named after the indicator, which is not a valid PyTables name
+            new = values[changed].rename(None)
+            if key in store and store.get_storer(key).is_table:
+                revised = np.sort(positions[changed & known])
+                if len(revised):
+                    store.remove(key, where=pd.Index(revised))
+                for start in range(0, len(new), chunk_size):
+                    store.append(key, _ns_dates(new.iloc[start:start + chunk_size]))
+            else:
+                merged = pd.concat([current.drop(values.index[changed & known]), new]).sort_index().rename(None)
+                store.put(key, _ns_dates(merged), format='table',
+                          min_itemsize={merged.index.names[0]: 100})
+
+            last = meta['last'] if 'last' in meta else last_date(current)
+            new_last = last_date(new)
+            if last is None or (new_last is not None and new_last > last):
+                last = new_last
+            store.get_storer(key).attrs.metadata = dict(code=code, name=name, fetched=fetched, last=last,
+                                                        version=meta.get('version', 1) + 1)
+            return int(changed.sum())
+
+
+def _ns_dates(values):
+    """The series with its dates as datetime64[ns], the resolution of the dates in a HDF table"""
+    index = values.index
+    return values.set_axis(index.set_levels(index.levels[1].astype('datetime64[ns]'), level=1))
+
+
+class ColumnarCache(object):
+    """World Bank indicators stored in a directory, as one .npy column per indicator.
+
+    The columns share a (country, date) row index, stored in 'country.npy' and 'date.npy', to which
+    new rows are appended when needed. The list of countries, and the name, fetch date, length and
+    version (incremented every time its values change) of every column, are in 'index.json'. Columns
+    are memory-mapped: opening the cache reads only the metadata and the row index, and the values of
+    an indicator are read when they are accessed. `upsert` updates a column in chunks, so that its
+    memory usage does not depend on the size of the column. Within `batch`, 'index.json' is read and
+    written only once, rather than at every write."""
+
+    def __init__(self, path):
+        self.path = path
+        self._index = None
+        self._info = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _save(self, name, array):
+        """Write an array to a temporary file, then rename it, so that readers never see a partial file"""
+        tmp = self._file(name + '.tmp.npy')
+        np.save(tmp, array)
+        os.replace(tmp, self._file(name))
+
+    def _read_json(self):
+        if self._info is not None:
+            return self._info
+        if not os.path.isfile(self._file('index.json')):
+            return dict(countries=[], indicators={})
+        with open(self._file('index.json')) as fp:
+            return json.load(fp)
+
+    def _write_json(self, info):
+        if self._info is not None:
+            self._info = info
+            return
+        tmp = self._file('index.json.tmp')
+        with open(tmp, 'w') as fp:
+            json.dump(info, fp, indent=1)
+        os.replace(tmp, self._file('index.json'))
+
+    @contextmanager
+    def batch(self):
+        """Keep the metadata in memory during a series of writes, and save it once, at the end"""
+        self._info = self._read_json()
+        try:
+            yield self
+        finally:
+            info, self._info = self._info, None
+            if os.path.isdir(self.path):
+                self._write_json(info)
+
+    def metadata(self, indicators=None):
+        """Name, fetch date, file, length, version and last date of the cached indicators, indexed by
+        indicator code"""
+        cached = {}
+        for code, meta in self._read_json()['indicators'].items():
+            cached[code] = dict(meta, code=code, fetched=pd.Timestamp(meta['fetched']), version=meta.get('version', 1))
+            if meta.get('last'):
+                cached[code]['last'] = pd.Timestamp(meta['last'])
+        return cached
+
+    def version(self):
+        """A counter that increases every time an indicator in the cache changes"""
+        return sum(meta['version'] for meta in self.metadata().values())
+
+    def index(self):
+        """The (country, date) index shared by all the columns"""
+        if self._index is None:
+            countries = self._read_json()['countries']
+            if not countries:
+                self._index = pd.MultiIndex.from_arrays([[], pd.DatetimeIndex([])], names=['country', 'date'])
+            else:
+                country = np.load(self._file('country.npy'))
+                date_codes, dates = pd.factorize(np.load(self._file('date.npy')))
+                self._index = pd.MultiIndex(levels=[countries, dates], codes=[country, date_codes],
+                                            names=['country', 'date'], verify_integrity=False)
+        return self._index
+
+    def read(self, meta):
+        """Values of the indicator described by 'meta', memory-mapped, indexed by country and date"""
+        values = np.load(self._file(meta['file']), mmap_mode='r')
+        return pd.Series(values, index=self.index()[:meta['length']], name=meta['name'], copy=False)
+
+    def _rows(self, info, labels):
+        """The rows of the given (country, date) labels, which are appended to the index when missing,
+        and the new length of the index"""
+        index = self.index()
+        rows = index.get_indexer(labels)
+
+        new = rows < 0
+        if new.any():
+            countries = pd.Index(info['countries'])
+            added = labels[new]
+            names = added.get_level_values(0)
+            info['countries'].extend(names.unique().difference(countries))
+            country = pd.Index(info['countries']).get_indexer(names)
+            date = added.get_level_values(1).values.astype('datetime64[ns]')
+            if len(index):
+                country = np.concatenate([np.load(self._file('country.npy')), country])
+                date = np.concatenate([np.load(self._file('date.npy')), date])
+            rows[new] = np.arange(len(index), len(index) + new.sum())
+            self._save('country.npy', country.astype(np.int32))
+            self._save('date.npy', date)
+            self._index = None
+            return rows, len(country)
+
+        return rows, len(index)
+
+    def write(self, code, name, values, fetched):
+        """Store (or replace) a single indicator. The other columns are not rewritten."""
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        info = self._read_json()
+        rows, length = self._rows(info, values.index)
+
+        column = np.full(length, np.nan)
+        column[rows] = values.values
+        file = code + '.npy'
+        self._save(file, column)
+
+        version = info['indicators'].get(code, {}).get('version', 0) + 1
+        last = last_date(values)
+        info['indicators'][code] = dict(name=name, fetched=fetched.isoformat(), file=file, length=length,
+                                        version=version, last=last.isoformat() if last is not None else None)
+        self._write_json(info)
+
+    def upsert(self, code, name, values, fetched, chunk_size=2 ** 16):
+        """Insert new rows, or update existing rows, of a single indicator, and return the number of
+        values that changed. The column is rewritten (only) if it changed: the current values are
+        copied to the new file 'chunk_size' rows at a time, and then the changed values are set."""
+        info = self._read_json()
+        meta = info['indicators'].get(code)
+        if meta is None:
+            self.write(code, name, values, fetched)
+            return int(values.notnull().sum())
+
+        countries = len(info['countries'])
+        rows, length = self._rows(info, values.index)
+        file = self._file(meta['file'])
+        current = np.load(file, mmap_mode='r')
+        previous = np.full(len(rows), np.nan)
+        known = rows < len(current)
+        previous[known] = current[rows[known]]
+        changed = changed_values(previous, values.values)
+        if not changed.any():
+            if len(info['countries']) > countries:
+                self._write_json(info)
+            return 0
+
+        tmp = self._file(meta['file'] + '.tmp.npy')
+        column = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float64, shape=(length,))
+        for start in range(0, length, chunk_size):
+            end = min(start + chunk_size, length)
+            column[start:end] = np.nan
+            copied = min(end, len(current))
+            if copied > start:
+                column[start:copied] = current[start:copied]
+        column[rows[changed]] = values.values[changed]
+        column.flush()
+        del column, current
+        os.replace(tmp, file)
+
+        last = pd.Timestamp(meta['last']) if meta.get('last') else last_date(self.read(dict(meta, name=name)))
+        new_last = last_date(values[changed])
+        if last is None or (new_last is not None and new_last > last):
+            last = new_last
+        info['indicators'][code] = dict(meta, name=name, fetched=fetched.isoformat(), length=length,
+                                        version=meta.get('version', 1) + 1,
+                                        last=last.isoformat() if last is not None else None)
+        self._write_json(info)
+        return int(changed.sum())
+
+
+def open_cache(path):
+    """A HDF cache for '.hdf' or '.h5' files, and a columnar cache for directories"""
+    if os.path.splitext(path)[1] in ('.hdf', '.h5'):
+        return HDFCache(path)
+    return ColumnarCache(path)
+
+
+class LRUCache(object):
+    """Values loaded on demand, and kept in memory up to 'max_bytes' (the sum of their 'nbytes'): above
+    that, the values that were used least recently are evicted. 'hits' and 'misses' count the values
+    that were, or were not, in memory"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._values = OrderedDict()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key, load):
+        """The value for 'key', or else 'load(key)', which is kept in memory"""
+        if key in self._values:
+            self.hits += 1
+            self._values.move_to_end(key)
+            return self._values[key]
+
+        self.misses += 1
+        value = load(key)
+        self._values[key] = value
+        self.nbytes += value.nbytes
+        while self.nbytes > self.max_bytes and len(self._values) > 1:
+            _, evicted = self._values.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+        return value
+
+
+class IndicatorColumns(object):
+    """Frame-like, read-only proxy for the indicators in a columnar cache.
+
+    Column names come from the cache metadata, and a column is only read from disk when it is
+    accessed. The columns that were read are kept in memory, up to 'max_bytes': above that, the
+    columns that were used least recently are evicted. `loc[country]` reads the rows of a single
+    country (or list of countries), for every indicator, without loading the full columns."""
+
+    def __init__(self, cache, indicators, max_bytes=2 ** 28):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        cached = cache.metadata()
+        self._meta = {name: cached[code] for code, name in indicators.items()}
+        self.loaded = LRUCache(max_bytes)
+
+    @property
+    def columns(self):
+        return pd.Index(list(self._meta))
+
+    @property
+    def index(self):
+        return self.cache.index()
+
+    @property
+    def loc(self):
+        return _CountryIndexer(self)
+
+    def __iter__(self):
+        return iter(self._meta)
+
+    def __len__(self):
+        return len(self._meta)
+
+    def __contains__(self, name):
+        return name in self._meta
+
+    def _load(self, name):
+        mapped = self.cache.read(self._meta[name])
+        return pd.Series(np.array(mapped.values), index=mapped.index, name=name)
+
+    def __getitem__(self, name):
+        return self.loaded.get(name, self._load)
+
+    def __repr__(self):
+        return '<IndicatorColumns: {} indicators, {} in memory ({:.1f} MB)>'.format(
+            len(self), len(self.loaded), self.loaded.nbytes / 2. ** 20)
+
+
+class _CountryIndexer(object):
+    """The `loc` attribute of `IndicatorColumns`"""
+
+    def __init__(self, columns):
+        self.columns = columns
+
+    def __getitem__(self, country):
+        index = self.columns.index
+        rows = index.get_locs([country])
+        data = {}
+        for name, meta in self.columns._meta.items():
+            mapped = self.columns.cache.read(meta).values
+            data[name] = np.take(mapped, rows[rows < len(mapped)])
+            if len(data[name]) < len(rows):
+                data[name] = np.concatenate([data[name], np.full(len(rows) - len(data[name]), np.nan)])
+
+        frame = pd.DataFrame(data, index=index[rows], columns=list(self.columns._meta))
+        if np.ndim(country) == 0:
+            return frame.loc[country]
+        return frame
+
+
+class CompactFrame(object):
+    """Frame-like, read-only and compact copy of indicators indexed by country and date.
+
+    The index is stored as small integer codes into the sorted countries and dates. Only the known
+    values of an indicator are stored, together with a validity bitmap or, when less than a fraction
+    'sparse_below' of the rows have a value, with the positions of these rows (which then take less
+    memory than the bitmap).
+    With dtype=None, an indicator is stored as float32 when that is lossless, and as float64
+    otherwise. Use dtype=np.float32 to store every indicator as float32, at the cost of precision.
+    Columns are decoded as float64 series when accessed, so `MetricStore` and `DerivedColumns` see
+    the same values as with a DataFrame. Only the last decoded columns are kept in memory, up to
+    'cache_bytes' (1 MB by default), and `loc[country]` decodes the rows of that country only."""
+
+    def __init__(self, countries, dates, country_codes, date_codes, columns, names=('country', 'date'),
+                 dtype=None, sparse_below=0.05, cache_bytes=2 ** 20):
+        self.countries = countries
+        self.dates = dates
+        self.country_codes = country_codes
+        self.date_codes = date_codes
+        self.dtype = dtype
+        self.sparse_below = sparse_below
+        self._columns = columns
+        self._names = list(names)
+        self._index = None
+        self.decoded = LRUCache(cache_bytes)
+
+    @classmethod
+    def from_series(cls, values, indicators, dtype=None, sparse_below=0.05):
+        """A compact frame with one column per indicator, from series indexed by country and date,
+        with the same rows as `to_dataframe`"""
+        series = [values[code] for code in indicators]
+        index = series[0].index
+        for other in series[1:]:
+            index = index.union(other.index)
+        index = index.sort_values()
+
+        columns = OrderedDict()
+        for (code, name), column in zip(indicators.items(), series):
+            rows = index.get_indexer(column.index)
+            columns[name] = _compact_column(rows, np.asarray(column.values, dtype=np.float64), len(index),
+                                            dtype, sparse_below)
+
+        return cls(*_index_codes(index), columns=columns, names=index.names, dtype=dtype, sparse_below=sparse_below)
+
+    @classmethod
+    def from_frame(cls, data, dtype=None, sparse_below=0.05):
+        """A compact copy of a frame indexed by country and date"""
+        return cls.from_series(data, OrderedDict((name, name) for name in data), dtype, sparse_below)
+
+    def with_columns(self, values):
+        """A compact frame where the columns in 'values', a dict of series indexed by country and date,
+        are replaced (or added). The other columns are shared with this frame when the rows are the same,
+        and are otherwise moved to the new rows, with their current precision."""
+        index = self.index
+        for series in values.values():
+            index = index.union(series.index)
+
+        columns = OrderedDict()
+        if len(index) == len(self.index):
+            codes = self.countries, self.dates, self.country_codes, self.date_codes
+            index = self.index
+            columns.update(self._columns)
+        else:
+            index = index.sort_values()
+            codes = _index_codes(index)
+            rows = index.get_indexer(self.index)
+            for name, column in self._columns.items():
+                columns[name] = _compact_column(rows, self._decode(name), len(index), column['values'].dtype,
+                                                self.sparse_below)
+
+        for name, series in values.items():
+            columns[name] = _compact_column(index.get_indexer(series.index),
+                                            np.asarray(series.values, dtype=np.float64), len(index),
+                                            self.dtype, self.sparse_below)
+        return CompactFrame(*codes, columns=columns, names=self._names, dtype=self.dtype,
+                            sparse_below=self.sparse_below, cache_bytes=self.decoded.max_bytes)
+
+    @property
+    def columns(self):
+        return pd.Index(list(self._columns))
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = pd.MultiIndex(levels=[self.countries, self.dates],
+                                        codes=[self.country_codes, self.date_codes], names=self._names)
+        return self._index
+
+    @property
+    def loc(self):
+        return _CompactIndexer(self)
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __len__(self):
+        return len(self._columns)
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def _decode(self, name):
+        """The float64 values of a column, at every row"""
+        column = self._columns[name]
+        values = np.full(len(self.country_codes), np.nan)
+        if 'valid' in column:
+            values[np.unpackbits(column['valid'], count=len(values)).view(bool)] = column['values']
+        else:
+            values[column['rows']] = column['values']
+        return values
+
+    def _decode_rows(self, name, rows):
+        """The float64 values of a column at the given sorted positions, decoded from these rows only"""
+        column = self._columns[name]
+        values = np.full(len(rows), np.nan)
+        if not len(rows):
+            return values
+        if 'rows' in column:
+            found = np.minimum(np.searchsorted(column['rows'], rows), len(column['rows']) - 1)
+            known = column['rows'][found] == rows if len(column['rows']) else np.zeros(len(rows), dtype=bool)
+            values[known] = column['values'][found[known]]
+            return values
+
+        # The values of the rows before the first one are counted in the bitmap, 8 rows per byte
+        first, last = rows[0] // 8, rows[-1] // 8 + 1
+        before = int(_BITS_SET[column['valid'][:first]].sum(dtype=np.int64))
+        valid = np.unpackbits(column['valid'][first:last]).view(bool)
+        positions = before + np.cumsum(valid) - 1
+        selected = rows - first * 8
+        known = valid[selected]
+        values[known] = column['values'][positions[selected[known]]]
+        return values
+
+    def _values(self, name, rows=None):
+        """The float64 values of a column, at the given positions (by default, at every row)"""
+        if rows is None:
+            return self[name].values
+        order = np.argsort(rows, kind='stable')
+        values = np.empty(len(rows))
+        values[order] = self._decode_rows(name, np.asarray(rows)[order])
+        return values
+
+    def _series(self, name):
+        return pd.Series(self._decode(name), index=self.index, name=name, copy=False)
+
+    def __getitem__(self, name):
+        return self.decoded.get(name, self._series)
+
+    @property
+    def nbytes(self):
+        """The size of the index codes and of the compact values, in bytes (not counting the decoded
+        columns)"""
+        return self.country_codes.nbytes + self.date_codes.nbytes + sum(
+            array.nbytes for column in self._columns.values() for array in column.values())
+
+    def to_frame(self):
+        """The indicators as a DataFrame of float64 columns"""
+        return pd.DataFrame(OrderedDict((name, self._decode(name)) for name in self), index=self.index)
+
+    def __repr__(self):
+        sparse = sum('rows' in column for column in self._columns.values())
+        return '<CompactFrame: {} rows, {} indicators ({} sparse), {:.1f} MB, {} decoded ({:.1f} MB)>'.format(
+            len(self.country_codes), len(self), sparse, self.nbytes / 2. ** 20, len(self.decoded),
+            self.decoded.nbytes / 2. ** 20)
+
+
+# The number of bits set in every byte
+_BITS_SET = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+
+def _code_dtype(count):
+    """The smallest integer type for codes into 'count' values"""
+    return np.min_scalar_type(max(count - 1, 0))
+
+
+def _index_codes(index):
+    """The sorted countries and dates of a (country, date) index, and the codes of its rows into them"""
+    countries, country_codes = np.unique(np.asarray(index.get_level_values(0)), return_inverse=True)
+    dates, date_codes = np.unique(index.get_level_values(1).values, return_inverse=True)
+    return (pd.Index(countries), pd.DatetimeIndex(dates), country_codes.astype(_code_dtype(len(countries))),
+            date_codes.astype(_code_dtype(len(dates))))
+
+
+def _compact_column(rows, values, length, dtype=None, sparse_below=0.05):
+    """The compact storage of the 'values' at the positions 'rows', in a column of the given length"""
+    known = ~np.isnan(values)
+    rows, values = rows[known], values[known]
+    if dtype is None:
+        dtype = np.float32 if np.array_equal(values.astype(np.float32), values) else np.float64
+
+    order = np.argsort(rows)
+    rows, values = rows[order], values[order].astype(dtype)
+    if len(values) < sparse_below * length:
+        return dict(rows=rows.astype(_code_dtype(length)), values=values)
+
+    valid = np.zeros(length, dtype=bool)
+    valid[rows] = True
+    return dict(values=values, valid=np.packbits(valid))
+
+
+class _CompactIndexer(object):
+    """The `loc` attribute of `CompactFrame`"""
+
+    def __init__(self, frame):
+        self.frame = frame
+
+    def __getitem__(self, country):
+        index = self.frame.index
+        rows = index.get_locs([country])
+        frame = pd.DataFrame(OrderedDict((name, self.frame._values(name, rows)) for name in self.frame),
+                             index=index[rows])
+        if np.ndim(country) == 0:
+            return frame.loc[country]
+        return frame
+
+
+def download_once(indicators, path, max_age=None, backend=None, max_workers=4, lazy=False, max_bytes=2 ** 28,
+                  compact=False, dtype=None):
+    """Indicators from the World Bank, cached at 'path': a HDF file ('.hdf' or '.h5'), or else a
+    directory of memory-mapped columns.
+
+    Only the indicators that are not in the cache, or that were fetched more than 'max_age' ago
+    (a pandas Timedelta, or a string like '30 days'), are downloaded, concurrently, from 'backend'
+    (the World Bank API by default). With 'lazy=True', and a columnar cache, the indicators are
+    returned as a lazy `IndicatorColumns` proxy that keeps at most 'max_bytes' of columns in memory,
+    rather than loaded into a DataFrame. With 'compact=True', they are loaded into a `CompactFrame`,
+    with values stored as 'dtype' (by default, float32 when that is lossless)."""
+    cache = open_cache(path)
+    if lazy and not isinstance(cache, ColumnarCache):
+        raise ValueError('Lazy loading requires a columnar cache, not {}'.format(path))
+    cached = cache.metadata(indicators)
+
+    now = pd.Timestamp.now()
+    oldest = now - pd.Timedelta(max_age) if max_age is not None else None
+
+    missing = {}
+    for code, name in indicators.items():
+        meta = cached.get(code)
+        if meta is None or meta['name'] != name or (oldest is not None and meta['fetched'] < oldest):
+            missing[code] = name
+
+    values = {}
+    if missing:
+        values = fetch_indicators(missing, backend, max_workers=max_workers)
+        for code, name in missing.items():
+            cache.write(code, name, values[code], now)
+
+    if lazy:
+        return IndicatorColumns(cache, indicators, max_bytes)
+
+    for code in indicators:
+        if code not in values:
+            values[code] = cache.read(cached[code])
+
+    if compact:
+        return CompactFrame.from_series(values, indicators, dtype)
+    return to_dataframe(values, indicators)
+
+
+def last_date(values):
+    """The last date at which a series, indexed by country and date, has a value"""
+    dates = values.index.get_level_values(1)[np.isfinite(np.asarray(values.values, dtype=np.float64))]
+    return dates.max() if len(dates) else None
+
+
+def refresh(indicators, path, full=(), overlap=2, backend=None, max_workers=4, chunk_size=2 ** 16):
+    """Update the indicators cached at 'path' with the new values, and the revisions, published since
+    they were downloaded, and return the number of values that changed, per indicator name.
+
+    For every indicator in the cache, only the dates from 'overlap' years before its last value are
+    downloaded, so that the revisions of the last values are also picked. The indicators that are not
+    in the cache yet, and those in 'full' (e.g. a series that was revised entirely), are downloaded
+    entirely. The new or revised rows are merged into the cache with `upsert`, one indicator at a
+    time; the indicators that did not change are not rewritten. Use `reload` to update the data
+    loaded from the cache with the indicators that changed."""
+    cache = open_cache(path)
+    cached = cache.metadata(indicators)
+
+    starts = {}
+    for code, name in indicators.items():
+        meta = cached.get(code)
+        if meta is not None and meta['name'] == name and code not in full:
+            # Caches written before the last date was stored in the metadata have to be read
+            last = meta['last'] if 'last' in meta else last_date(cache.read(meta))
+            if last is not None:
+                starts[code] = last - pd.DateOffset(years=overlap)
+
+    now = pd.Timestamp.now()
+    values = fetch_indicators(indicators, backend, max_workers=max_workers, starts=starts)
+
+    changed = {}
+    with cache.batch():
+        for code, name in indicators.items():
+            count = cache.upsert(code, name, values[code], now, chunk_size)
+            if count:
+                changed[name] = count
+    return changed
+
+
+def reload(data, path, indicators, changed):
+    """The 'data' returned by `download_once`, for the same 'path' and 'indicators', where the indicators
+    in 'changed' (by name, as returned by `refresh`) are read again from the cache. The other indicators
+    are not read, and, in a DataFrame or a `CompactFrame`, not copied either unless new rows were added."""
+    cache = open_cache(path)
+    if isinstance(data, IndicatorColumns):
+        return IndicatorColumns(cache, indicators, data.max_bytes)
+
+    cached = cache.metadata(indicators)
+    values = OrderedDict((name, cache.read(cached[code])) for code, name in indicators.items() if name in changed)
+    if isinstance(data, CompactFrame):
+        return data.with_columns(values)
+
+    kept = data.drop(columns=list(values))
+    index = kept.index
+    for series in values.values():
+        index = index.union(series.index)
+    if len(index) > len(kept.index):
+        kept = kept.reindex(index.sort_values())
+    return kept.assign(**{name: series.reindex(kept.index) for name, series in values.items()})[list(indicators.values())]
+
+
+def load_cache(path, lazy=False, max_bytes=2 ** 28, compact=False, dtype=None):
+    """All the indicators in the cache at 'path', without downloading anything"""
+    cache = open_cache(path)
+    if lazy and not isinstance(cache, ColumnarCache):
+        raise ValueError('Lazy loading requires a columnar cache, not {}'.format(path))
+    cached = cache.metadata()
+    indicators = {code: meta['name'] for code, meta in cached.items()}
+
+    if lazy:
+        return IndicatorColumns(cache, indicators, max_bytes)
+
+    values = {code: cache.read(meta) for code, meta in cached.items()}
+    if compact:
+        return CompactFrame.from_series(values, indicators, dtype)
+    return to_dataframe(values, indicators)
+
+
+class MetricStore(object):
+    """Every metric, pivoted into a dense (date, zone) array per metric, with the World as the last zone.
+
+    The slice of a metric is filled the first time that metric is accessed, so that, with a lazy
+    'data' like `IndicatorColumns`, only the metrics that are actually plotted are read from disk.
+    The series returned by `world` and `regions` are views on that slice: they are built once per
+    metric, and no data is copied when they are requested again. The slices are kept in memory up to
+    'max_bytes' (by default, the 'max_bytes' of 'data', if any): above that, the slices of the metrics
+    that were used least recently are evicted, together with their views.
+
+    'version' identifies the data, and 'versions' the data of every metric, for the caches of objects
+    derived from the store: they are incremented by `update`. 'hits' and 'misses' count the views
+    that were, or were not, already built."""
+
+    def __init__(self, data, zones, world='World', max_bytes=None):
+        self.zones = list(zones)
+        self.world_name = world
+        self.max_bytes = getattr(data, 'max_bytes', None) if max_bytes is None else max_bytes
+        self.version = 0
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self._reset(data)
+
+    def _reset(self, data):
+        self.data = data
+        self.metrics = list(data)
+        self.country = data.index.names[0]
+
+        columns = self.zones + [self.world_name]
+        self.dates = data.index.get_level_values(1).unique().sort_values()
+        self._target = pd.MultiIndex.from_product([columns, self.dates])
+
+        self.nbytes = 0
+        self._slices = OrderedDict()
+        self.position = {metric: i for i, metric in enumerate(self.metrics)}
+        self.versions = {metric: self.versions.get(metric, 0) for metric in self.metrics}
+        self._world = {}
+        self._regions = {}
+
+    def update(self, data, changed=None):
+        """Use the new 'data', in which only the metrics in 'changed' (by default, all) differ.
+
+        The slices and views of the other metrics are kept, unless the metrics or the dates changed."""
+        changed = set(data if changed is None else changed)
+        dates = data.index.get_level_values(1).unique().sort_values()
+        if list(data) != self.metrics or not dates.equals(self.dates):
+            self._reset(data)
+        else:
+            self.data = data
+            for metric in changed & set(self.metrics):
+                self._evict(metric)
+
+        for metric in changed & set(self.metrics):
+            self.versions[metric] += 1
+        self.version += 1
+
+    def __contains__(self, metric):
+        return metric in self.position
+
+    def __iter__(self):
+        return iter(self.metrics)
+
+    def additive(self, metric):
+        """Can the metric be summed over regions? See `metrics.is_additive`"""
+        return is_additive(metric, self.data)
+
+    def _evict(self, metric):
+        """Forget the slice, and the views, of a metric"""
+        values = self._slices.pop(metric, None)
+        if values is not None:
+            self.nbytes -= values.nbytes
+        self._world.pop(metric, None)
+        self._regions.pop(metric, None)
+
+    def _slice(self, metric):
+        """The (date, zone) slice for the given metric, filled on first access"""
+        if metric in self._slices:
+            self._slices.move_to_end(metric)
+            return self._slices[metric]
+
+        values = self.data[metric].reindex(self._target).values
+        values = np.ascontiguousarray(values.reshape(len(self.zones) + 1, len(self.dates)).T)
+        self._slices[metric] = values
+        self.nbytes += values.nbytes
+        while self.max_bytes is not None and self.nbytes > self.max_bytes and len(self._slices) > 1:
+            self._evict(next(iter(self._slices)))
+        return values
+
+    @staticmethod
+    def _rows(available):
+        """A slice (when possible, to get a view) or else the positions of the available dates"""
+        rows = np.flatnonzero(available)
+        if len(rows) and rows[-1] - rows[0] + 1 == len(rows):
+            return slice(rows[0], rows[-1] + 1)
+        return rows
+
+    def world(self, metric):
+        """Value of the desired metric, on the World, indexed by date"""
+        if metric in self._world:
+            self.hits += 1
+            self._slices.move_to_end(metric)
+        else:
+            self.misses += 1
+            values = self._slice(metric)[:, -1]
+            rows = self._rows(~np.isnan(values))
+            self._world[metric] = pd.Series(values[rows], index=self.dates[rows], name=metric, copy=False)
+        return self._world[metric]
+
+    def regions(self, metric):
+        """Value of the desired metric, per zone (column), indexed by date"""
+        if metric in self._regions:
+            self.hits += 1
+            self._slices.move_to_end(metric)
+        else:
+            self.misses += 1
+            values = self._slice(metric)[:, :-1]
+            rows = self._rows(~np.isnan(values).all(axis=1))
+            self._regions[metric] = pd.DataFrame(values[rows], index=self.dates[rows],
+                                                 columns=pd.Index(self.zones, name=self.country),
+                                                 copy=False)
+        return self._regions[metric]
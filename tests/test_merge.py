@@ -0,0 +1,130 @@
+import json
+import subprocess
+import jupytext
+import nbformat
+import pytest
+from jupytext_tools.merge import merge_notebooks, merge_file, merge_unmerged
+
+HEADER = '''# ---
+# jupyter:
+#   jupytext:
+#     text_representation:
+#       extension: .py
+#       format_name: light
+# ---
+'''
+
+BASE = HEADER + '''
+import pandas as pd
+
+data = pd.DataFrame({'x': [1, 2]})
+
+def double(x):
+    y = x * 2
+    z = y + 0
+    return z
+
+data.sum()
+'''
+
+
+def merge(ours, theirs, base=BASE):
+    return merge_notebooks(base, ours, theirs, 'py')
+
+
+def sources(text):
+    return [cell.source for cell in jupytext.reads(text, fmt='py').cells]
+
+
+def test_insertions_at_the_same_place_are_kept():
+    ours = BASE.replace('import pandas as pd\n', 'import pandas as pd\n\nours = 1\n')
+    theirs = BASE.replace('import pandas as pd\n', 'import pandas as pd\n\ntheirs = 2\n')
+    text, conflicts = merge(ours, theirs)
+    assert conflicts == 0
+    assert sources(text)[:3] == ['import pandas as pd', 'ours = 1', 'theirs = 2']
+
+
+def test_one_sided_edit():
+    theirs = BASE.replace("[1, 2]", "[1, 2, 3]")
+    assert merge(BASE, theirs) == (theirs, 0)
+    assert merge(theirs, BASE) == (theirs, 0)
+
+
+def test_cell_edited_on_both_sides_is_merged_line_by_line():
+    ours = BASE.replace('y = x * 2', 'y = 2 * x')
+    theirs = BASE.replace('return z', 'return int(z)')
+    text, conflicts = merge(ours, theirs)
+    assert conflicts == 0
+    assert 'def double(x):\n    y = 2 * x\n    z = y + 0\n    return int(z)' in sources(text)
+
+
+def test_conflict():
+    ours = BASE.replace('y = x * 2', 'y = 2 * x')
+    theirs = BASE.replace('y = x * 2', 'y = x + x')
+    text, conflicts = merge(ours, theirs)
+    assert conflicts == 1
+    assert '<<<<<<< ours\n' in text and '=======\n' in text and '>>>>>>> theirs\n' in text
+    assert text.index('y = 2 * x') < text.index('y = x + x')
+    assert text.count("data = pd.DataFrame({'x': [1, 2]})") == 1
+
+
+def write(path, text):
+    path.write(text)
+    return str(path)
+
+
+def test_other_files_are_merged_with_git_merge_file(tmpdir):
+    base = write(tmpdir.join('base.txt'), 'a\nb\nc\n')
+    ours = write(tmpdir.join('ours.txt'), 'A\nb\nc\n')
+    theirs = write(tmpdir.join('theirs.txt'), 'a\nb\nC\n')
+    assert merge_file(base, ours, theirs) == 0
+    assert tmpdir.join('ours.txt').read() == 'A\nb\nC\n'
+
+    theirs = write(tmpdir.join('theirs.txt'), 'a2\nb\nc\n')
+    assert merge_file(base, ours, theirs) == 1
+    assert '<<<<<<< ours' in tmpdir.join('ours.txt').read()
+
+
+def test_merge_file_updates_the_paired_ipynb(tmpdir):
+    base = BASE.replace('#       format_name: light\n', '#       format_name: light\n#     formats: ipynb,py:light\n')
+    notebook = jupytext.reads(base, fmt='py')
+    for cell in notebook.cells:
+        cell.outputs = [nbformat.v4.new_output('stream', name='stdout', text='output\n')]
+    jupytext.write(notebook, str(tmpdir.join('notebook.ipynb')))
+
+    ours = write(tmpdir.join('notebook.py'), base)
+    theirs = write(tmpdir.join('theirs.py'), base.replace("[1, 2]", "[1, 2, 3]"))
+    assert merge_file(write(tmpdir.join('base.py'), base), ours, theirs, ours) == 0
+
+    with open(str(tmpdir.join('notebook.ipynb'))) as fp:
+        cells = json.load(fp)['cells']
+    assert ''.join(cells[1]['source']) == "data = pd.DataFrame({'x': [1, 2, 3]})"
+    assert [cell['outputs'][0]['text'] for cell in cells] == [['output\n']] * 4
+
+
+def test_unmerged_notebooks_are_merged_and_binary_files_left_to_git(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+
+    def git(*args):
+        subprocess.check_call(['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com'] + list(args),
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def commit(text, data):
+        write(tmpdir.join('notebook.py'), text)
+        tmpdir.join('cache.hdf').write_binary(data)
+        git('commit', '-qam', 'commit')
+
+    git('init', '-q')
+    write(tmpdir.join('notebook.py'), BASE)
+    tmpdir.join('cache.hdf').write_binary(b'\x89HDF\r\n\x1a\n\xff\x00')
+    git('add', '.')
+    git('commit', '-qm', 'base')
+    git('checkout', '-qb', 'theirs')
+    commit(BASE.replace('import pandas as pd\n', 'import pandas as pd\n\ntheirs = 2\n'), b'\x89HDF\r\n\x1a\n\xfe\x01')
+    git('checkout', '-q', '-')
+    commit(BASE.replace('import pandas as pd\n', 'import pandas as pd\n\nours = 1\n'), b'\x89HDF\r\n\x1a\n\xfd\x02')
+    with pytest.raises(subprocess.CalledProcessError):
+        git('merge', 'theirs')
+
+    assert merge_unmerged() == (['notebook.py'], [])
+    assert sources(tmpdir.join('notebook.py').read())[:3] == ['import pandas as pd', 'ours = 1', 'theirs = 2']
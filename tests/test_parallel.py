@@ -0,0 +1,19 @@
+import os
+import jupytext
+from jupytext_tools.parallel import cell_names, code_cells, dependencies, schedule
+
+NOTEBOOK = os.path.join(os.path.dirname(__file__), '..', 'notebook', 'Greenhouse_gas_emissions.py')
+
+
+def test_locals_of_nested_scopes_are_not_reads():
+    assert cell_names('def f():\n    v = 3\n    return [x + v for x in range(3)]') == ({'range'}, {'f'})
+    assert cell_names('[[x for y in z] for x in w]')[0] == {'w', 'z'}
+
+
+def test_run_last_cells_do_not_serialize_the_notebook():
+    cells, run_last = code_cells(jupytext.read(NOTEBOOK))
+    assert len(run_last) == 1
+    groups = schedule(dependencies([cell.source for cell in cells]), 4, run_last)
+    assert len(groups) > 1
+    assert sum(group[-1] in run_last for group in groups) == 1
+    assert all(i not in group[:-1] for group in groups for i in run_last)
@@ -0,0 +1,23 @@
+import os
+import sys
+import plotly.graph_objs as go
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'notebook'))
+from plotting import update_traces  # noqa: E402
+
+
+def test_update_traces_resets_the_properties_of_the_previous_traces():
+    figure = go.Figure()
+    regions = [dict(name=region, stackgroup='World', x=[0, 1], y=[1, 2]) for region in ['Asia', 'Europe']]
+    update_traces(figure, regions + [dict(name='World', line=dict(dash='dash'), x=[0, 1], y=[2, 4])])
+
+    # From the World regions to the G20 groups: one trace less, the World line now comes second
+    groups = [dict(name='G7', stackgroup=None, x=[0, 1], y=[1, 1])]
+    update_traces(figure, groups + [dict(name='World', line=dict(dash='dash'), x=[0, 1], y=[2, 4])])
+    assert [trace.name for trace in figure.data] == ['G7', 'World']
+    assert [trace.stackgroup for trace in figure.data] == [None, None]
+    assert [trace.line.dash for trace in figure.data] == [None, 'dash']
+
+    update_traces(figure, regions + [dict(name='World', line=dict(dash='dash'), x=[0, 1], y=[2, 4])])
+    assert [trace.stackgroup for trace in figure.data] == ['World', 'World', None]
+    assert [trace.line.dash for trace in figure.data] == [None, None, 'dash']
@@ -0,0 +1,28 @@
+import os
+from jupytext_tools.sync import main, sync_tree
+
+SCRIPT = '''# ---
+# jupyter:
+#   jupytext:
+#     formats: ipynb,py:light
+# ---
+
+1 + 1
+'''
+
+
+def test_a_failing_pair_does_not_stop_the_others(tmpdir, capsys):
+    tmpdir.join('good.py').write(SCRIPT)
+    tmpdir.join('bad.ipynb').write('{"metadata": {"jupytext": {"formats": "ipynb,py:light"}}, not json')
+    root = str(tmpdir)
+
+    synced, skipped, failed = sync_tree(root, jobs=1)
+    assert synced == [(os.path.join(root, 'good.ipynb'), os.path.join(root, 'good.py'))]
+    assert [pair for pair, _ in failed] == [(os.path.join(root, 'bad.ipynb'), os.path.join(root, 'bad.py'))]
+    assert tmpdir.join('good.ipynb').check()
+
+    # The pair that was synchronized is recorded, and the failing one is tried again
+    assert main([root, '--jobs', '1']) == 1
+    out, err = capsys.readouterr()
+    assert '0 pair(s) synchronized, 1 already in sync' in out
+    assert 'Failed: {}'.format(os.path.join(root, 'bad.ipynb')) in err
@@ -0,0 +1,84 @@
+import json
+import jupytext
+import nbformat
+from jupytext_tools.update import update_ipynb
+
+SCRIPT = '''# # A notebook
+
+import pandas as pd
+
+data = pd.DataFrame({'x': [1, 2]})
+data
+
+# A comment
+data.sum()
+'''
+
+
+def write_pair(tmpdir, script):
+    text_path = tmpdir.join('notebook.py')
+    text_path.write(script)
+    notebook = jupytext.read(str(text_path))
+    for i, cell in enumerate(notebook.cells):
+        if cell.cell_type == 'code':
+            cell.outputs = [nbformat.v4.new_output('stream', name='stdout', text='output {}\n'.format(i))]
+    ipynb_path = tmpdir.join('notebook.ipynb')
+    jupytext.write(notebook, str(ipynb_path))
+    return str(text_path), str(ipynb_path)
+
+
+def read_cells(ipynb_path):
+    with open(ipynb_path) as fp:
+        return json.load(fp)['cells']
+
+
+def test_unchanged_cells_are_copied(tmpdir):
+    text_path, ipynb_path = write_pair(tmpdir, SCRIPT)
+    before = read_cells(ipynb_path)
+    assert update_ipynb(text_path) == (4, 0)
+    assert read_cells(ipynb_path) == before
+
+
+def test_edited_cell_keeps_its_outputs(tmpdir):
+    text_path, ipynb_path = write_pair(tmpdir, SCRIPT)
+    tmpdir.join('notebook.py').write(SCRIPT.replace("{'x': [1, 2]}", "{'x': [1, 2, 3]}"))
+    assert update_ipynb(text_path) == (3, 1)
+
+    cells = read_cells(ipynb_path)
+    assert ''.join(cells[2]['source']) == "data = pd.DataFrame({'x': [1, 2, 3]})\ndata"
+    assert cells[2]['outputs'][0]['text'] == ['output 2\n']
+    assert cells[3]['outputs'][0]['text'] == ['output 3\n']
+
+
+def test_new_cell_has_no_outputs(tmpdir):
+    text_path, ipynb_path = write_pair(tmpdir, SCRIPT)
+    tmpdir.join('notebook.py').write(SCRIPT.replace('import pandas as pd\n', 'import pandas as pd\n\nprint(1)\n'))
+    assert update_ipynb(text_path) == (4, 1)
+
+    cells = read_cells(ipynb_path)
+    assert [''.join(cell['source']) for cell in cells][1:4] == ['import pandas as pd', 'print(1)',
+                                                               "data = pd.DataFrame({'x': [1, 2]})\ndata"]
+    assert cells[2]['outputs'] == []
+    assert cells[3]['outputs'][0]['text'] == ['output 2\n']
+
+
+def read_metadata(ipynb_path):
+    with open(ipynb_path) as fp:
+        return json.load(fp)['metadata']
+
+
+def test_metadata_are_those_of_the_text_notebook(tmpdir):
+    script = SCRIPT.replace('data.sum()', '# + tags=["parameters"]\ndata.sum()\n# -')
+    text_path, ipynb_path = write_pair(tmpdir, script)
+    notebook = jupytext.read(ipynb_path)
+    notebook.cells[3].metadata['collapsed'] = True
+    notebook.metadata['language_info'] = {'name': 'python'}
+    jupytext.write(notebook, ipynb_path)
+
+    # The tag is removed in the text notebook, and the output-related metadata are kept
+    tmpdir.join('notebook.py').write(SCRIPT)
+    assert update_ipynb(text_path) == (3, 1)
+    assert [cell['metadata'] for cell in read_cells(ipynb_path)] == [{}, {}, {}, {'collapsed': True}]
+    metadata = read_metadata(ipynb_path)
+    assert metadata['language_info'] == {'name': 'python'}
+    assert 'text_representation' not in metadata.get('jupytext', {})